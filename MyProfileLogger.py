@@ -3,7 +3,6 @@
 
 #Logging tool that allows a user to moniter their own account over time
 
-import instaloader
 import datetime
 import numpy as np
 from config import config
@@ -13,6 +12,8 @@ def profile_information(profile):
     
     """Grab current profile information and save to a dataframe"""
 
+    import instaloader
+
     L = instaloader.Instaloader()
     
     info = {
@@ -2,32 +2,53 @@
 #RMS 2019 
 
 import numpy as np
-import instaloader
 import pandas as pd
 import os
 import datetime
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import config
+from ratelimit import TokenBucket
+from instrumentation import instrumented
 
 class ExtractParkStats():
 
     """Get useful information about each of the park instagram pages"""
 
     def __init__(self, profile_list=config.PROFILES_TO_DOWNLOAD,download_dir=config.DATASETS,\
-        logfile=config.PROFILE_LOGGER,username=config.INSTA_UNAME,password=config.INSTA_PASS) -> None:
+        store=config.PROFILE_STORE,username=config.INSTA_UNAME,password=config.INSTA_PASS,\
+        workers=config.DL_WORKERS,rate=config.DL_RATE,burst=config.DL_BURST,\
+        retries=config.REQUEST_RETRIES,backoff=config.REQUEST_BACKOFF,\
+        loader=None,profile_lookup=None) -> None:
+
+        """loader and profile_lookup default to instaloader.Instaloader and
+        instaloader.Profile.from_username, and can be replaced with local stand-ins for testing"""
 
         self.profiles = pd.read_csv(profile_list,names=['profile_name','profile_id'])
         self.download_dir = download_dir
-        self.logfilename = logfile
+        self.store = store
         self.username = username
         self.password = password
-        self.L = instaloader.Instaloader(quiet=True)
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
 
-        if os.path.isfile(logfile):
-            self.logfile = pd.read_csv(self.logfilename,sep='\t')
-        else:
-            self.logfile = 'None'
+        if loader is None or profile_lookup is None:
+            import instaloader
+        if loader is None:
+            loader = instaloader.Instaloader(quiet=True)
+        if profile_lookup is None:
+            profile_lookup = instaloader.Profile.from_username
+
+        self.L = loader
+        self.profile_lookup = profile_lookup
 
+        #Shared by all the lookup threads, to stay under Instagram's rate limits
+        self.rate_limit = TokenBucket(rate,burst)
 
+
+    @instrumented('extract_park_stats')
     def download(self) -> None:
         """Do the download across all profiles"""
 
@@ -35,39 +56,190 @@ class ExtractParkStats():
 
         current_data = self._profile_information()
 
-        if isinstance(self.logfile,str):
-            current_data.to_csv(self.logfilename,index=False,sep='\t')
-        else:
-            self.logfile = pd.concat([self.logfile,current_data],axis=0)
-            self.logfile.to_csv(self.logfilename,index=False,sep='\t')
+        store = ProfileStore(self.store)
+        store.append(current_data)
+        store.close()
 
-    def _profile_information(self) -> pd.DataFrame:
-        
-        """Grab current profile information and save to a dataframe"""
-        
-        info = {
-            'name':[],
-            'userid':[],
-            'followers':[],
-            'followees':[],
-            'bio':[],
-            'time':[]
+    def _fetch_profile(self,profile) -> dict:
+
+        """Look up one profile, retrying with exponential backoff if the request fails"""
+
+        import instaloader
+
+        for attempt in range(self.retries+1):
+
+            self.rate_limit.acquire()
+
+            try:
+                prof_data = self.profile_lookup(self.L.context,profile)
+                break
+            except instaloader.ProfileNotExistsException:
+                raise
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff*2**attempt
+                print(f'{profile}: attempt {attempt+1} failed ({e}), retrying in {delay:.1f} seconds')
+                time.sleep(delay)
+
+        return {
+            'name':profile,
+            'userid':prof_data.userid,
+            'followers':prof_data.followers,
+            'followees':prof_data.followees,
+            'bio':prof_data.biography,
+            'time':datetime.datetime.now()
         }
+
+    def _profile_information(self) -> pd.DataFrame:
         
-        for profile in list(self.profiles['profile_name']):
-                   
-            #try:
-                prof_data = instaloader.Profile.from_username(self.L.context,profile)
-                
-                ctime = datetime.datetime.now()
-                info['name'].append(profile)
-                info['time'].append(ctime)
-                info['userid'].append(prof_data.userid)
-                info['followers'].append(prof_data.followers)
-                info['followees'].append(prof_data.followees)
-                info['bio'].append(prof_data.biography)
-            
-            #except:
-            #    continue
-                
-        return pd.DataFrame(info)
+        """Grab current profile information and save to a dataframe. Profiles are looked up
+        concurrently on a shared session; profiles that still fail after retrying are reported
+        (and kept in self.failures) and left out, rather than losing the whole snapshot"""
+
+        profiles = list(self.profiles['profile_name'])
+        results = {}
+        self.failures = {}
+
+        t0 = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+
+            futures = {pool.submit(self._fetch_profile,profile):profile for profile in profiles}
+
+            for future in as_completed(futures):
+                profile = futures[future]
+                try:
+                    results[profile] = future.result()
+                except Exception as e:
+                    self.failures[profile] = e
+
+        t1 = time.time()
+        print(f'Got stats for {len(results)} of {len(profiles)} profiles in {t1-t0:.1f} seconds')
+
+        for profile, error in self.failures.items():
+            print(f'Could not get stats for {profile}: {error}')
+
+        columns = ['name','userid','followers','followees','bio','time']
+
+        return pd.DataFrame([results[profile] for profile in profiles if profile in results],columns=columns)
+
+
+class ProfileStore():
+
+    """Append-only store of profile snapshots, indexed on (userid, time) so that the latest
+    snapshot of each profile, or the last few days of history, can be read without loading
+    everything. The old tab separated profile log is imported the first time the store is opened"""
+
+    COLUMNS = ['name','userid','followers','followees','bio','time']
+
+    def __init__(self,dbfile=config.PROFILE_STORE,legacy_log=config.PROFILE_LOGGER) -> None:
+
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile,timeout=30)
+
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS snapshots (name TEXT, userid TEXT, followers INTEGER, '
+                'followees INTEGER, bio TEXT, time TEXT)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS snapshots_userid_time ON snapshots (userid,time)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS snapshots_time ON snapshots (time)')
+
+        if self.conn.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0] == 0 and os.path.isfile(legacy_log):
+            self.append(pd.read_csv(legacy_log,sep='\t'))
+
+    def close(self) -> None:
+
+        self.conn.close()
+
+    def append(self,snapshot) -> None:
+
+        """Add the rows of a dataframe like the one made by ExtractParkStats._profile_information"""
+
+        snapshot = snapshot[self.COLUMNS].astype({'userid':str,'time':str})
+        rows = [tuple(None if pd.isnull(value) else value for value in row) \
+            for row in snapshot.astype(object).itertuples(index=False)]
+
+        with self.conn:
+            self.conn.executemany('INSERT INTO snapshots VALUES (?,?,?,?,?,?)',rows)
+
+    def latest(self) -> pd.DataFrame:
+
+        """The most recent snapshot of each profile"""
+
+        return pd.read_sql_query('SELECT s.* FROM snapshots s JOIN '
+            '(SELECT userid, MAX(time) AS time FROM snapshots GROUP BY userid) m '
+            'ON s.userid = m.userid AND s.time = m.time',self.conn,parse_dates=['time'])
+
+    def history(self,days,userid=None) -> pd.DataFrame:
+
+        """All snapshots from the last days days, of one profile or of all of them"""
+
+        since = str(datetime.datetime.now() - datetime.timedelta(days=days))
+
+        if userid is None:
+            query, params = 'SELECT * FROM snapshots WHERE time >= ? ORDER BY time', (since,)
+        else:
+            query, params = 'SELECT * FROM snapshots WHERE userid = ? AND time >= ? ORDER BY time', (str(userid),since)
+
+        return pd.read_sql_query(query,self.conn,params=params,parse_dates=['time'])
+
+    def followers_at(self,userids,times,margin_days=30) -> np.ndarray:
+
+        """Follower count of each profile at each time, linearly interpolated between snapshots and
+        held constant before the first and after the last. Only snapshots from margin_days before the
+        earliest time onwards are read, plus the latest snapshot of profiles with none in that window.
+        NaN for profiles with no snapshots at all"""
+
+        userids = pd.Series(userids).astype(str).values
+        times = pd.to_datetime(pd.Series(times)).values.astype('datetime64[us]').astype(np.float64)
+        followers = np.full(len(userids),np.nan)
+
+        if len(userids) == 0:
+            return followers
+
+        since = pd.Timestamp(times.min(),unit='us') - pd.Timedelta(days=margin_days)
+        history = pd.read_sql_query('SELECT userid,time,followers FROM snapshots WHERE time >= ? ORDER BY time',\
+            self.conn,params=(str(since),),parse_dates=['time'])
+        latest = self.latest()[['userid','time','followers']]
+        history = pd.concat([history,latest[~latest['userid'].isin(history['userid'])]])
+        history = history.dropna(subset=['followers'])
+
+        for userid, snapshots in history.groupby('userid'):
+            rows = userids == userid
+            if rows.any():
+                snapshot_times = snapshots['time'].values.astype('datetime64[us]').astype(np.float64)
+                followers[rows] = np.interp(times[rows],snapshot_times,snapshots['followers'].values.astype(np.float64))
+
+        return followers
+
+    def follower_trend(self,days) -> pd.DataFrame:
+
+        """Change in followers of each profile over the last days days, from the first and last
+        snapshots in that window"""
+
+        history = self.history(days)
+        grouped = history.groupby('userid')
+
+        trend = pd.DataFrame({
+            'name':grouped['name'].last(),
+            'first_time':grouped['time'].first(),
+            'last_time':grouped['time'].last(),
+            'first_followers':grouped['followers'].first(),
+            'last_followers':grouped['followers'].last()
+        })
+        trend['follower_change'] = trend['last_followers'] - trend['first_followers']
+
+        return trend.reset_index()
+
+
+def latest_profile_stats(store=config.PROFILE_STORE) -> dict:
+
+    """Most recent (name, followers) of each profile in the ExtractParkStats snapshots, keyed by
+    userid. Used in place of live profile lookups when packing post metadata"""
+
+    profile_store = ProfileStore(store)
+    latest = profile_store.latest()
+    profile_store.close()
+
+    return {str(userid):(name,followers) for name, userid, followers in \
+        zip(latest['name'],latest['userid'],latest['followers'].tolist())}
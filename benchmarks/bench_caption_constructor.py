@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Time CaptionConstructor on synthetic captions and check that it agrees with the original
+#row-by-row implementation
+#Run from the package root: python benchmarks/bench_caption_constructor.py
+
+import argparse
+import re
+import time
+import numpy as np
+import pandas as pd
+from synthetic import make_metadata_frame, make_captions
+from config import config
+import preprocessing as pp
+
+
+def legacy_caption_constructor(X) -> pd.DataFrame:
+
+    """The original per-row implementation, kept here as a reference"""
+
+    X = X.copy()
+    hashtagQClist = config.HASHTAG_QC
+
+    def __extract_hashtags(string):
+
+        try:
+            hashtags = [re.sub(r"(\W+)$", "", j) for j in set([i for i in string.split() if i.startswith("#")])]
+        except:
+            return np.nan
+        if len(hashtags) == 0:
+            return np.nan
+        else:
+            return hashtags
+
+    def __extract_pcredits(row):
+        string = row['caption']
+
+        try:
+            pcredits = [re.sub(r"(\W+)$", "", j) for j in set([i for i in string.split() if i.startswith("@")])]
+            pcredits.append('@'+row['credits'])
+        except:
+            return np.nan
+
+        return pcredits
+
+    def __hashtagQC(hashtags):
+        
+        hashstring = ''.join(hashtags).lower()
+        for word in hashtagQClist:
+            if word in hashstring:
+                return np.nan
+        return [e.lower() for e in hashtags if len(e) > 1]
+
+    def __generate_repost_caption(row):
+
+        caption = row['caption']
+        date = row['postdate']
+        credit = row['credits']
+        a = re.split("[.!]+", caption)[0]
+        
+        if a[-1] == '?':
+            a[-1] == '!'
+        else:
+            a = a+'!'
+
+        a = re.sub('[@$""'']', '', a)
+        
+        post_date = f"{date.month:02d}-{date.day:02d}-{date.year}"
+            
+        comment = f'Here is a segment from the original post, by @{credit} on {post_date}: "{a}"'
+        return comment
+
+    X['hashtags'] = X['caption'].apply(__extract_hashtags)
+    X['pcredits'] = X.apply(lambda row: __extract_pcredits(row),axis=1)
+    X['postdate'] = pd.to_datetime(X['postdate'])
+
+    X.dropna(inplace=True)
+
+    X['hashtags'] = X['hashtags'].apply(__hashtagQC)
+    X['repost_comment'] = X.apply(lambda row: __generate_repost_caption(row),axis=1)
+
+    X.dropna(inplace=True)
+
+    X.reset_index(inplace=True,drop=True)
+
+    return X
+
+
+def compare(fast,slow) -> None:
+
+    """The outputs must match, except for the order of the hashtags and mentions, which the
+    original took from a set"""
+
+    assert list(fast.columns) == list(slow.columns)
+    assert len(fast) == len(slow)
+
+    for column in fast.columns:
+        if column in ['hashtags','pcredits']:
+            assert [sorted(tags) for tags in fast[column]] == [sorted(tags) for tags in slow[column]], column
+        else:
+            assert fast[column].equals(slow[column]), column
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes',type=int,nargs='+',default=[1000,10000,100000])
+    parser.add_argument('--legacy-max',type=int,default=100000,
+        help='largest size at which the slow reference implementation is also run')
+    args = parser.parse_args()
+
+    for ncaptions in args.sizes:
+
+        X = make_metadata_frame(ncaptions)
+        X['caption'] = make_captions(ncaptions)
+        cc = pp.CaptionConstructor().fit(X)
+
+        t0 = time.perf_counter()
+        fast = cc.transform(X)
+        t1 = time.perf_counter()
+
+        print(f'{ncaptions:>8d} captions: vectorized {t1-t0:.3f} s ({len(fast)} pass the QC)')
+
+        if ncaptions <= args.legacy_max:
+
+            t0 = time.perf_counter()
+            slow = legacy_caption_constructor(X)
+            t1 = time.perf_counter()
+
+            compare(fast,slow)
+
+            print(f'{ncaptions:>8d} captions: row-wise   {t1-t0:.3f} s (outputs match)')
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Compare the pickled classifier with its TorchScript exports (fp32 and int8 dynamically quantized):
+#load time, resident memory once loaded, and images/sec through ContentDetermination. Each variant
+#is measured in a fresh process. Uses config.CLASSIFIERPATH if it is a pickled model that exists,
+#otherwise an untrained vgg16 with the same number of classes
+#Run from the package root: python benchmarks/bench_classifier_export.py
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+from synthetic import make_jpegs
+from config import config
+
+
+def rss() -> int:
+
+    """Current resident set size of this process in bytes (Linux only)"""
+
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])*1024
+
+def measure(classifier,image_files,batch_size) -> dict:
+
+    """Load classifier in this process and classify image_files with it"""
+
+    import preprocessing as pp
+    import torch
+
+    X = pd.DataFrame({'Flocation':image_files})
+    cd = pp.ContentDetermination(classifier=classifier,batch_size=batch_size,cache=None)
+
+    rss0 = rss()
+    t0 = time.perf_counter()
+    cd.fit(X)
+    t1 = time.perf_counter()
+    rss1 = rss()
+
+    #one batch to warm up, then time the rest
+    cd.predict_classes(image_files[:batch_size])
+    t2 = time.perf_counter()
+    predictions = cd.predict_classes(image_files)
+    t3 = time.perf_counter()
+
+    return {'load_seconds':t1-t0,'model_rss_bytes':rss1-rss0,'images_per_second':len(image_files)/(t3-t2),\
+        'peak_rss_bytes':rss(),'predictions':predictions}
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nimages',type=int,default=64)
+    parser.add_argument('--batch-size',type=int,default=config.CLASSIFIER_BATCH_SIZE)
+    parser.add_argument('--output',default=None,help='also write the results to this JSON file')
+    parser.add_argument('--child',nargs=3,metavar=('CLASSIFIER','IMAGE_LIST','RESULT_FILE'),help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        classifier, image_list, result_file = args.child
+        with open(image_list) as infile:
+            image_files = infile.read().split('\n')
+        with open(result_file,'w') as outfile:
+            json.dump(measure(classifier,image_files,args.batch_size),outfile)
+        return
+
+    import torch
+    from torchvision import models
+    import preprocessing as pp
+    from export_classifier import export, can_quantize
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        image_files = make_jpegs(os.path.join(tmpdir,'images'),args.nimages)
+        image_list = os.path.join(tmpdir,'images.txt')
+        with open(image_list,'w') as outfile:
+            outfile.write('\n'.join(image_files))
+
+        classifier = config.CLASSIFIERPATH
+        if classifier is None or classifier.endswith('.pt') or not os.path.isfile(classifier):
+            classifier = os.path.join(tmpdir,'vgg16_untrained.pkl')
+            torch.save(models.vgg16(num_classes=len(config.IMAGE_CLASSES)),classifier)
+
+        variants = {'pickled fp32':classifier,'TorchScript fp32':os.path.join(tmpdir,'model.pt')}
+
+        model = pp.load_pickled_model(classifier)
+        export(model,variants['TorchScript fp32'])
+        if can_quantize():
+            variants['TorchScript int8'] = os.path.join(tmpdir,'model_int8.pt')
+            export(model,variants['TorchScript int8'],quantize=True)
+        else:
+            print(f'Skipping the int8 variant: quantization needs torch 1.3 or later (this is torch {torch.__version__})')
+        del model
+
+        results = {}
+
+        for name, path in variants.items():
+
+            result_file = os.path.join(tmpdir,'result.json')
+            subprocess.run([sys.executable,os.path.abspath(__file__),'--batch-size',str(args.batch_size),\
+                '--child',path,image_list,result_file],check=True,cwd=config.PACKAGE_ROOT)
+            with open(result_file) as infile:
+                results[name] = json.load(infile)
+
+            results[name]['file_bytes'] = os.path.getsize(path)
+
+        reference = results['pickled fp32'].pop('predictions')
+
+        for name, result in results.items():
+            predictions = result.pop('predictions',reference)
+            result['agreement'] = sum(a == b for a, b in zip(reference,predictions))/len(reference)
+            print(f"{name:18s} {result['file_bytes']/2**20:6.0f} MB file, loads in {result['load_seconds']:6.2f} s, "
+                f"{result['model_rss_bytes']/2**20:6.0f} MB resident, {result['images_per_second']:7.2f} images/sec, "
+                f"{result['agreement']:.0%} agreement with the pickled model")
+
+    if args.output:
+        with open(args.output,'w') as outfile:
+            json.dump(results,outfile,indent=2)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Compare images/sec of batched, prefetched classification in ContentDetermination against the
+#original one-image-at-a-time loop, on CPU only. Uses config.CLASSIFIERPATH if it exists,
+#otherwise an untrained vgg16 with the same number of classes
+#Run from the package root: python benchmarks/bench_content_determination.py
+
+import argparse
+import os
+import tempfile
+import time
+import pandas as pd
+import torch
+from torchvision import models
+from PIL import Image
+from synthetic import make_jpegs
+from config import config
+import preprocessing as pp
+
+
+def legacy_classify(cd,image_files) -> list:
+
+    """The original loop: one image per forward pass, with autograd enabled"""
+
+    predictions = []
+
+    for image_file in image_files:
+        img = cd.transform_validation(Image.open(image_file))
+        output = cd.mymodel(img.unsqueeze(0))
+        _, preds = torch.max(output,1)
+        predictions.append(cd.classes[preds.item()])
+
+    return predictions
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nimages',type=int,default=64)
+    parser.add_argument('--batch-sizes',type=int,nargs='+',default=[1,8,16,32])
+    parser.add_argument('--workers',type=int,default=config.CLASSIFIER_WORKERS)
+    parser.add_argument('--threads',type=int,default=config.TORCH_THREADS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        image_files = make_jpegs(tmpdir,args.nimages)
+
+        classifier = config.CLASSIFIERPATH
+        if classifier is None or not os.path.isfile(classifier):
+            classifier = os.path.join(tmpdir,'vgg16_untrained.pkl')
+            torch.save(models.vgg16(num_classes=len(config.IMAGE_CLASSES)),classifier)
+
+        X = pd.DataFrame({'Flocation':image_files})
+
+        cd = pp.ContentDetermination(classifier=classifier,num_workers=args.workers,
+            num_threads=args.threads).fit(X)
+
+        t0 = time.perf_counter()
+        reference = legacy_classify(cd,image_files)
+        t1 = time.perf_counter()
+        print(f'loop (no batching, autograd on): {args.nimages/(t1-t0):8.2f} images/sec')
+
+        for batch_size in args.batch_sizes:
+
+            cd.batch_size = batch_size
+            t0 = time.perf_counter()
+            predictions = cd.predict_classes(image_files)
+            t1 = time.perf_counter()
+
+            agree = sum(a == b for a, b in zip(reference,predictions))/len(reference)
+            print(f'batched (batch size {batch_size:3d}):      {args.nimages/(t1-t0):8.2f} images/sec, '
+                f'{agree:.0%} agreement with loop')
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Run DownloadNewPosts against the local fake Instaloader with injected latency, and compare
+#the time taken with one download thread against several
+#Run from the package root: python benchmarks/bench_downloader.py
+
+import argparse
+import os
+import tempfile
+import time
+from fakes import FakeInstaloader
+from config import config
+import datadownloaders as dd
+
+
+def run(nprofiles,workers,latency,rate,burst) -> None:
+
+    cwd = os.getcwd()
+
+    #everything the download reads or writes is in a fresh directory for each run, so that runs
+    #start from the same state and nothing in data/ is touched
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        profile_list = os.path.join(tmpdir,'profiles.csv')
+        with open(profile_list,'w') as outfile:
+            for i in range(nprofiles):
+                outfile.write(f'park{i},{1000+i}\n')
+
+        os.mkdir(os.path.join(tmpdir,'repo'))
+
+        #instaloader downloads into folders named after each profile, relative to the working directory
+        os.chdir(tmpdir)
+
+        try:
+            loader = FakeInstaloader(latency=latency)
+            downloader = dd.DownloadNewPosts(profile_list=profile_list,repo=os.path.join(tmpdir,'repo'),\
+                index=os.path.join(tmpdir,'index.db'),profile_store=os.path.join(tmpdir,'profile_log.db'),\
+                high_water=os.path.join(tmpdir,'high_water.csv'),workers=workers,rate=rate,burst=burst,\
+                loader=loader,profile_lookup=loader.profile_from_id)
+
+            t0 = time.perf_counter()
+            downloader.download()
+            t1 = time.perf_counter()
+        finally:
+            os.chdir(cwd)
+
+        print(f'{workers:3d} workers: {nprofiles} profiles in {t1-t0:.2f} s, '
+            f'{loader.logins} login(s), {loader.requests} requests')
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nprofiles',type=int,default=50)
+    parser.add_argument('--workers',type=int,nargs='+',default=[1,config.DL_WORKERS,16])
+    parser.add_argument('--latency',type=float,default=0.05,help='seconds per fake request')
+    parser.add_argument('--rate',type=float,default=1000.0,help='requests per second allowed by the rate limit')
+    parser.add_argument('--burst',type=int,default=config.DL_BURST)
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        run(args.nprofiles,workers,args.latency,args.rate,args.burst)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Time a whole posting cycle offline: PackMetadata.process_posts, each process_pipe stage and
+#ChoosePost, on a synthetic post database at several sizes. Each size is run twice, first with
+#empty caches (cold) and then again (warm). Results are saved as JSON so that runs can be compared
+#Run from the package root: python benchmarks/bench_end_to_end.py [--database DIR] [--output FILE]
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from datetime import datetime
+from synthetic import make_post_database, DATABASE_MARKER
+from fakes import FakeTopicModel
+from config import config
+import datadownloaders as dd
+import preprocessing as pp
+import instrumentation
+
+
+def build_steps(workdir,topic_model=True) -> list:
+
+    """The stages of pipeline.build_process_pipe, with their caches and ledger in workdir"""
+
+    steps = [
+        ('near_duplicate_filter',pp.NearDuplicateFilter(cache=workdir+'/phash_cache.db',ledger=workdir+'/post_ledger.db',\
+            hash_cache=workdir+'/content_hash_cache.db')),
+        ('feature_generation',pp.FeatureGenerator(size_cache=workdir+'/image_size_cache.db')),
+        ('caption_construction',pp.CaptionConstructor())
+    ]
+
+    if config.USE_CLASSIFIER == True:
+        steps.append(('image_classification',pp.ContentDetermination(cache=workdir+'/classification_cache.db')))
+
+    if topic_model:
+        steps.append(('content_classification',pp.CaptionTopicModelling(cache=workdir+'/classification_cache.db')))
+    else:
+        steps.append(('content_classification',FakeTopicModel()))
+
+    steps.append(('image_choice',pp.ChoosePost()))
+
+    return steps
+
+
+def database(directory,nposts,nparks,workers) -> list:
+
+    """Sidecars of the synthetic database in directory, generating it if it is too small. They are
+    returned in a fixed random order, so that the first n are a fair sample of the parks. Only a
+    directory made by a previous run (or a new or empty one) is ever regenerated"""
+
+    metafiles = sorted(glob.glob(directory+'/*.json.xz'))
+
+    if len(metafiles) < nposts:
+        if os.path.isdir(directory) and os.listdir(directory):
+            if not os.path.isfile(os.path.join(directory,DATABASE_MARKER)):
+                sys.exit(f'{directory} is not a synthetic post database made by this benchmark, so it will not be '
+                    'replaced. Give a new or empty directory with --database')
+            shutil.rmtree(directory)
+        print(f'Generating a synthetic post database of {nposts} posts from {nparks} parks in {directory}')
+        metafiles = sorted(make_post_database(directory,nposts,nparks=nparks,workers=workers))
+
+    return [metafiles[i] for i in np.random.RandomState(0).permutation(len(metafiles))]
+
+
+def make_repo(metafiles,repo) -> None:
+
+    """Hard link the posts into repo, so each size is a subset of the same database"""
+
+    os.makedirs(repo)
+
+    for metafile in metafiles:
+        for path in [metafile,metafile[:-len('.json.xz')]+'.jpg']:
+            os.link(path,os.path.join(repo,os.path.basename(path)))
+
+
+def run_cycle(repo,workdir,steps,queue_size) -> list:
+
+    """One offline posting cycle, returning the instrumentation records of each stage"""
+
+    metadata_gen = dd.PackMetadata(repo=repo,ledger=workdir+'/post_ledger.db',index=workdir+'/metadata_index.db',\
+        profile_store=workdir+'/profile_log.db',hash_cache=workdir+'/content_hash_cache.db')
+
+    with instrumentation.cycle('benchmark',jsonl=None,prometheus=None) as metrics:
+
+        X = metadata_gen.process_posts()
+        X = instrumentation.run_steps(steps[:-1],X)
+
+        choose_post = steps[-1][1]
+
+        with instrumentation.stage('choose_post.transform',len(X)):
+            choose_post.transform(X)
+
+        with instrumentation.stage('choose_post.schedule',len(X)) as record:
+            record['rows_out'] = len(choose_post.schedule(X,queue_size))
+
+    return metrics.records
+
+
+def git_commit() -> str:
+
+    try:
+        return subprocess.run(['git','rev-parse','HEAD'],cwd=config.PACKAGE_ROOT,capture_output=True,text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes',type=int,nargs='+',default=[1000,10000,100000])
+    parser.add_argument('--nparks',type=int,default=50)
+    parser.add_argument('--database',default=None,help='where to keep the synthetic database between runs '
+        '(a temporary directory, deleted afterwards, if not given). Must be new, empty or made by an earlier run')
+    parser.add_argument('--workers',type=int,default=None,help='processes used to render the JPEGs')
+    parser.add_argument('--queue-size',type=int,default=config.POST_QUEUE_SIZE)
+    parser.add_argument('--fake-topic-model',action='store_true',
+        help='assign random caption classes instead of loading the pickled caption models')
+    parser.add_argument('--output',default='bench_end_to_end.json')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    database_dir = args.database or os.path.join(tmpdir,'database')
+
+    results = {'date':str(datetime.now()),'commit':git_commit(),'python':platform.python_version(),\
+        'nparks':args.nparks,'use_classifier':config.USE_CLASSIFIER,'runs':[]}
+
+    try:
+
+        metafiles = database(database_dir,max(args.sizes),args.nparks,args.workers)
+
+        for nposts in sorted(args.sizes):
+
+            repo = os.path.join(tmpdir,f'posts_{nposts}')
+            workdir = os.path.join(tmpdir,f'work_{nposts}')
+            os.makedirs(workdir)
+            make_repo(metafiles[:nposts],repo)
+
+            steps = build_steps(workdir,topic_model=not args.fake_topic_model)
+
+            for run in ['cold','warm']:
+
+                records = run_cycle(repo,workdir,steps,args.queue_size)
+                results['runs'].append({'nposts':nposts,'run':run,'stages':records})
+
+                print(f'\n{nposts} posts, {run}:')
+                for record in records:
+                    print(f"    {record['stage']:40s} {record['wall_seconds']:8.3f} s wall {record['cpu_seconds']:8.3f} s cpu "
+                        f"{record['rows_in'] if record['rows_in'] is not None else '':>7} -> {record['rows_out'] if record['rows_out'] is not None else '':<7} "
+                        f"{(record['peak_rss_bytes'] or 0)/2**20:7.0f} MB")
+                print(f"    {'total':40s} {sum(record['wall_seconds'] for record in records):8.3f} s wall")
+
+    finally:
+        shutil.rmtree(tmpdir,ignore_errors=True)
+
+    with open(args.output,'w') as outfile:
+        json.dump(results,outfile,indent=2,default=str)
+
+    print(f'\nResults written to {args.output}')
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Time the rank feature generation in FeatureGenerator at several scales and check
+#that it agrees with the original row-by-row implementation
+#Run from the package root: python benchmarks/bench_feature_generator.py
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from synthetic import make_metadata_frame
+from config import config
+import preprocessing as pp
+
+
+def legacy_rank_features(fg,X) -> pd.DataFrame:
+
+    """The original per-row implementation, kept here as a reference"""
+
+    X = X.copy()
+
+    def __difference_from_mean(row,column):
+
+        ndays = (fg.now - row['postdate']).days
+        if ndays < 1:
+            ndays = 1
+        mean = fg.summary[fg.summary['credits']==row['credits']][column].values[0]
+        return (row[column] - mean)/(mean*ndays)
+
+    X['postdate'] = pd.to_datetime(X['postdate'])
+    X['mean_nlikes_diff'] = X.apply(lambda row: __difference_from_mean(row,'nlikes_per_follower'),axis=1)
+    X['mean_ncomments_diff'] = X.apply(lambda row: __difference_from_mean(row,'ncomments_per_follower'),axis=1)
+    X['park_id'] = X['credits'].apply(lambda name: fg.names_dir[name])
+    X['rank'] = X['mean_nlikes_diff']*config.LIKES_WEIGHT + X['mean_ncomments_diff']*config.COMMENT_WEIGHT
+
+    return X
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes',type=int,nargs='+',default=[10000,100000,1000000])
+    parser.add_argument('--legacy-max',type=int,default=10000,
+        help='largest size at which the slow reference implementation is also run')
+    args = parser.parse_args()
+
+    for nposts in args.sizes:
+
+        X = make_metadata_frame(nposts)
+        fg = pp.FeatureGenerator().fit(X)
+
+        t0 = time.perf_counter()
+        fast = fg.generate_rank_features(X.copy())
+        t1 = time.perf_counter()
+
+        print(f'{nposts:>8d} posts: vectorized {t1-t0:.3f} s')
+
+        if nposts <= args.legacy_max:
+
+            t0 = time.perf_counter()
+            slow = legacy_rank_features(fg,X)
+            t1 = time.perf_counter()
+
+            for column in ['mean_nlikes_diff','mean_ncomments_diff','park_id','rank']:
+                np.testing.assert_allclose(fast[column].values,slow[column].values,rtol=1e-10)
+
+            print(f'{nposts:>8d} posts: row-wise   {t1-t0:.3f} s (outputs match)')
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Report how long the entry points and the modules they use take to import, from python -X importtime
+#run in a fresh interpreter for each module, along with the heaviest modules each one pulls in
+#Run from the package root: python benchmarks/bench_import_time.py [--json import_times.json]
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+import synthetic #puts the package root on sys.path
+from config import config
+
+MODULES = ['config.config','datadownloaders','ProfileManip','preprocessing','pipeline',\
+    'run_posting','download_posts','MyProfileLogger','posting_daemon']
+
+#Modules that the entry points should not import until they are needed
+HEAVY_MODULES = ['torch','torchvision','matplotlib','instaloader','instapy_cli']
+
+
+def import_times(module) -> dict:
+
+    """Import module in a new interpreter and parse the -X importtime report. Times are in seconds"""
+
+    t0 = time.perf_counter()
+    result = subprocess.run([sys.executable,'-X','importtime','-c',f'import {module}'],\
+        cwd=config.PACKAGE_ROOT,capture_output=True,text=True)
+    wall = time.perf_counter() - t0
+
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr}')
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imported[name.strip()] = (int(self_us)/1e6,int(cumulative_us)/1e6)
+
+    return {'module':module,'wall':wall,'cumulative':imported[module][1],'imported':imported}
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--modules',nargs='+',default=MODULES)
+    parser.add_argument('--repeats',type=int,default=3,help='best of this many runs is reported')
+    parser.add_argument('--top',type=int,default=5,help='number of heaviest imports to list')
+    parser.add_argument('--json',default=None,help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+
+    for module in args.modules:
+
+        best = min((import_times(module) for _ in range(args.repeats)),key=lambda run: run['cumulative'])
+        heaviest = sorted(best['imported'].items(),key=lambda item: item[1][0],reverse=True)[:args.top]
+        heavy = [name for name in HEAVY_MODULES if name in best['imported']]
+
+        print(f"{module}: {best['cumulative']:.3f} s to import ({best['wall']:.3f} s with interpreter startup), "
+            f"{len(best['imported'])} modules")
+        for name, (self_time, _) in heaviest:
+            print(f'    {name:40s} {self_time:.3f} s')
+        if heavy:
+            print(f"    heavy modules imported: {', '.join(heavy)}")
+
+        results.append({'module':module,'cumulative_seconds':best['cumulative'],'wall_seconds':best['wall'],\
+            'nmodules':len(best['imported']),'heavy_modules':heavy,\
+            'heaviest':[{'module':name,'self_seconds':self_time} for name, (self_time, _) in heaviest]})
+
+    if args.json:
+        with open(args.json,'w') as outfile:
+            json.dump(results,outfile,indent=2)
+
+
+if __name__ == "__main__":
+
+    main()
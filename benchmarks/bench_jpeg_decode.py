@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Compare the ways ContentDetermination can decode JPEGs (config.CLASSIFIER_DECODE): time to decode
+#each image and to preprocess it into the model input, the dimensions the image is decoded at,
+#how far the model input moves from that of a full decode and how often the predicted classes agree.
+#On synthetic images this uses config.CLASSIFIERPATH if it exists, otherwise an untrained vgg16 with
+#the same number of classes (so agreement is only indicative). With --holdout it uses the labelled
+#holdout set of export_classifier.py and the trained classifier, and also reports accuracy
+#Run from the package root: python benchmarks/bench_jpeg_decode.py [--holdout [DIR]]
+
+import argparse
+import os
+import tempfile
+import time
+import sys
+import pandas as pd
+import torch
+from torchvision import models
+from synthetic import make_jpegs
+from config import config
+import preprocessing as pp
+from export_classifier import holdout_images
+
+
+def measure(cd,image_files) -> dict:
+
+    """Decode and preprocess each image with cd, returning per-image means and the model inputs"""
+
+    decode_seconds, load_seconds, decoded_pixels = 0, 0, 0
+    inputs = []
+
+    for image_file in image_files:
+
+        t0 = time.perf_counter()
+        img = cd._decode_image(image_file)
+        t1 = time.perf_counter()
+        inputs.append(cd.transform_validation(img))
+        t2 = time.perf_counter()
+
+        decode_seconds += t1 - t0
+        load_seconds += t2 - t0
+        decoded_pixels += img.width*img.height
+
+    n = len(image_files)
+
+    return {'decode_ms':1000*decode_seconds/n,'preprocess_ms':1000*load_seconds/n,\
+        'decoded_pixels':decoded_pixels/n,'inputs':torch.stack(inputs)}
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nimages',type=int,default=64)
+    parser.add_argument('--width',type=int,default=1080)
+    parser.add_argument('--height',type=int,default=1350)
+    parser.add_argument('--no-classify',action='store_true',help='skip comparing the predicted classes')
+    parser.add_argument('--holdout',nargs='?',const=config.CLASSIFIER_HOLDOUT,default=None,
+        help='use the labelled holdout images (in config.CLASSIFIER_HOLDOUT if no directory is given)')
+    args = parser.parse_args()
+
+    labels = None
+    classifier = config.CLASSIFIERPATH
+    has_classifier = classifier is not None and os.path.isfile(classifier)
+
+    if args.holdout:
+        image_files, labels = holdout_images(args.holdout)
+        if not image_files:
+            sys.exit(f'No holdout images found in {args.holdout}')
+        if not has_classifier:
+            sys.exit('Accuracy on the holdout set needs the trained classifier in config.CLASSIFIERPATH')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        if not args.holdout:
+            image_files = make_jpegs(tmpdir,args.nimages,width=args.width,height=args.height)
+
+        if not has_classifier:
+            classifier = os.path.join(tmpdir,'vgg16_untrained.pkl')
+            torch.save(models.vgg16(num_classes=len(config.IMAGE_CLASSES)),classifier)
+
+        X = pd.DataFrame({'Flocation':image_files})
+        results = {}
+
+        for decode in pp.ContentDetermination.DECODE_SCALES:
+
+            cd = pp.ContentDetermination(classifier=classifier,cache=None,decode=decode).fit(X)
+            #once through so the files are in the page cache for every mode
+            measure(cd,image_files[:4])
+            results[decode] = measure(cd,image_files)
+
+            if labels is not None or not args.no_classify:
+                results[decode]['predictions'] = cd.predict_classes(image_files)
+
+    reference = results['full']
+
+    if args.holdout:
+        print(f'{len(image_files)} holdout images, model input {pp.ContentDetermination.INPUT_SIZE} px')
+    else:
+        print(f'{args.nimages} JPEGs of {args.width}x{args.height}, model input {pp.ContentDetermination.INPUT_SIZE} px')
+
+    for decode, result in results.items():
+
+        difference = (result['inputs'] - reference['inputs']).abs().mean().item()
+        #the number of pixels decoded, not a measurement of memory used
+        line = f"{decode:8s} decode {result['decode_ms']:7.2f} ms ({reference['decode_ms']/result['decode_ms']:4.1f}x faster), " \
+            f"preprocess {result['preprocess_ms']:7.2f} ms, {result['decoded_pixels']/1e6:5.2f} Mpixels decoded per image, " \
+            f"mean input difference {difference:.4f}"
+        if 'predictions' in result:
+            agreement = sum(a == b for a, b in zip(reference['predictions'],result['predictions']))/len(image_files)
+            line += f', {agreement:.1%} agreement with full'
+        if labels is not None:
+            accuracy = sum(a == b for a, b in zip(result['predictions'],labels))/len(labels)
+            line += f', {accuracy:.1%} accuracy'
+        print(line)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Time near-duplicate lookups with HammingIndex against a brute force scan, on random 64 bit
+#hashes with some planted near duplicates
+#Run from the package root: python benchmarks/bench_near_duplicates.py
+
+import argparse
+import time
+import numpy as np
+from synthetic import PACKAGE_ROOT
+from config import config
+from hammingindex import HammingIndex
+
+
+def make_hashes(nhashes,nduplicates,max_distance,seed=0) -> list:
+
+    rng = np.random.RandomState(seed)
+    hashes = [int(value) for value in rng.randint(0,2**63,size=nhashes,dtype=np.int64)]
+
+    #flip a few bits of randomly chosen hashes
+    for i in rng.randint(0,nhashes,size=nduplicates):
+        value = hashes[i]
+        for bit in rng.choice(63,size=rng.randint(1,max_distance+1),replace=False):
+            value ^= 1 << int(bit)
+        hashes.append(value)
+
+    return hashes
+
+
+def dedup_index(hashes,max_distance) -> int:
+
+    index = HammingIndex(max_distance)
+    nduplicates = 0
+    for value in hashes:
+        if index.has_near(value):
+            nduplicates += 1
+        else:
+            index.add(value)
+
+    return nduplicates
+
+
+def dedup_brute_force(hashes,max_distance) -> int:
+
+    kept = []
+    nduplicates = 0
+    for value in hashes:
+        if any(bin(value ^ other).count('1') <= max_distance for other in kept):
+            nduplicates += 1
+        else:
+            kept.append(value)
+
+    return nduplicates
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes',type=int,nargs='+',default=[1000,10000,100000])
+    parser.add_argument('--brute-force-max',type=int,default=10000)
+    parser.add_argument('--max-distance',type=int,default=config.PHASH_MAX_DISTANCE)
+    args = parser.parse_args()
+
+    for nhashes in args.sizes:
+
+        hashes = make_hashes(nhashes,nhashes//20,args.max_distance)
+
+        t0 = time.perf_counter()
+        found = dedup_index(hashes,args.max_distance)
+        t1 = time.perf_counter()
+        print(f'{len(hashes):>7d} images: index       {t1-t0:8.3f} s, {found} near duplicates')
+
+        if nhashes <= args.brute_force_max:
+            t0 = time.perf_counter()
+            found = dedup_brute_force(hashes,args.max_distance)
+            t1 = time.perf_counter()
+            print(f'{len(hashes):>7d} images: brute force {t1-t0:8.3f} s, {found} near duplicates')
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Run ExtractParkStats against the local fake profile service with injected latency (and
+#optionally failures), and compare one lookup thread against several
+#Run from the package root: python benchmarks/bench_profile_stats.py
+
+import argparse
+import os
+import tempfile
+import time
+from fakes import FakeInstaloader
+from config import config
+import ProfileManip as pm
+
+
+def run(nprofiles,workers,latency,failure_rate,backoff) -> None:
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        profile_list = os.path.join(tmpdir,'profiles.csv')
+        with open(profile_list,'w') as outfile:
+            for i in range(nprofiles):
+                outfile.write(f'park{i}nps,{1000+i}\n')
+
+        loader = FakeInstaloader(latency=latency,failure_rate=failure_rate)
+        stats = pm.ExtractParkStats(profile_list=profile_list,store=os.path.join(tmpdir,'store.db'),\
+            workers=workers,rate=1000.0,backoff=backoff,loader=loader,profile_lookup=loader.profile_from_username)
+
+        t0 = time.perf_counter()
+        stats.download()
+        t1 = time.perf_counter()
+
+        print(f'{workers:3d} workers: {nprofiles} profiles in {t1-t0:.2f} s, {loader.requests} requests, '
+            f'{len(stats.failures)} failed')
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nprofiles',type=int,default=50)
+    parser.add_argument('--workers',type=int,nargs='+',default=[1,config.DL_WORKERS,16])
+    parser.add_argument('--latency',type=float,default=0.2,help='seconds per fake request')
+    parser.add_argument('--failure-rate',type=float,default=0.1)
+    parser.add_argument('--backoff',type=float,default=0.1)
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        run(args.nprofiles,workers,args.latency,args.failure_rate,args.backoff)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Time sidecar parsing with datadownloaders.scan_sidecars, serially and across different numbers
+#of worker processes, on a synthetic directory of sidecars
+#Run from the package root: python benchmarks/bench_sidecar_scan.py
+
+import argparse
+import os
+import tempfile
+import time
+from synthetic import make_sidecars
+from config import config
+import datadownloaders as dd
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nposts',type=int,default=50000)
+    parser.add_argument('--workers',type=int,nargs='+',default=[1,2,4,os.cpu_count()])
+    parser.add_argument('--chunksize',type=int,default=config.SCAN_CHUNKSIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        t0 = time.perf_counter()
+        metafiles = make_sidecars(tmpdir,args.nposts,images=False)
+        t1 = time.perf_counter()
+        print(f'Wrote {args.nposts} sidecars in {t1-t0:.1f} s')
+
+        for workers in sorted(set(args.workers)):
+
+            t0 = time.perf_counter()
+            nparsed = sum(1 for _ in dd.scan_sidecars(metafiles,workers=workers,chunksize=args.chunksize))
+            t1 = time.perf_counter()
+
+            print(f'{workers:3d} workers: {nparsed} sidecars in {t1-t0:.2f} s ({nparsed/(t1-t0):.0f} per second)')
+
+
+if __name__ == "__main__":
+
+    main()
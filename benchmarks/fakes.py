@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Local stand-ins for the parts of instaloader that the downloaders use. Each request sleeps
+#for a configurable latency instead of going to the network
+
+import os
+import threading
+import time
+import numpy as np
+from datetime import datetime, timedelta
+from synthetic import write_sidecar
+
+
+class FakePost():
+
+    def __init__(self,profile,date,index) -> None:
+
+        self.profile = profile
+        self.date = date
+        self.date_utc = date
+        self.shortcode = f'{profile.userid}x{index}'
+
+    def __repr__(self) -> str:
+
+        return f'<FakePost {self.shortcode}>'
+
+
+class FakeProfile():
+
+    """A profile with one post every interval hours, newest first"""
+
+    def __init__(self,userid,latency,nposts=30,interval=6) -> None:
+
+        self.userid = int(userid)
+        self.username = f'park{userid}'
+        self.followers = 100000 + self.userid % 1000000
+        self.followees = 100
+        self.biography = f'Official account of park {userid}'
+        self.latency = latency
+        self.nposts = nposts
+        self.interval = interval
+
+    def get_posts(self):
+
+        now = datetime.now()
+        for i in range(self.nposts):
+            #a new page of results every 12 posts, as on Instagram
+            if i % 12 == 0:
+                time.sleep(self.latency)
+            yield FakePost(self,now - timedelta(hours=self.interval*i),i)
+
+
+class FakeInstaloader():
+
+    """Counts logins and requests, and writes a sidecar plus an empty image for each
+    downloaded post. A fraction failure_rate of requests (other than logins) raise ConnectionError"""
+
+    def __init__(self,latency=0.05,failure_rate=0.0,seed=0) -> None:
+
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = np.random.RandomState(seed)
+        self.context = None
+        self.logins = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _request(self) -> None:
+
+        with self.lock:
+            self.requests += 1
+            failed = self.rng.uniform() < self.failure_rate
+        time.sleep(self.latency)
+
+        if failed:
+            raise ConnectionError('fake request failed')
+
+    def login(self,user,passwd) -> None:
+
+        self.logins += 1
+        time.sleep(self.latency)
+
+    def profile_from_id(self,context,profile_id) -> FakeProfile:
+
+        self._request()
+        return FakeProfile(profile_id,self.latency)
+
+    def profile_from_username(self,context,username) -> FakeProfile:
+
+        self._request()
+        return FakeProfile(sum(map(ord,username)),self.latency)
+
+    def download_post(self,post,target) -> bool:
+
+        self._request()
+        os.makedirs(target,exist_ok=True)
+
+        name = os.path.join(target,post.date.strftime('%Y-%m-%d_%H-%M-%S_UTC'))
+        rng = np.random.RandomState(hash(post.shortcode) % 2**32)
+        write_sidecar(name+'.json.xz',post.profile.userid,post.profile.username,\
+            post.profile.followers,post.date.timestamp(),rng)
+        open(name+'.jpg','wb').close()
+
+        return True
+
+
+class FakeTopicModel():
+
+    """Stands in for preprocessing.CaptionTopicModelling where the pickled caption models cannot
+    be loaded (e.g. a different sklearn version). Assigns random caption classes"""
+
+    def __init__(self,nclasses=3,seed=0) -> None:
+
+        self.nclasses = nclasses
+        self.rng = np.random.RandomState(seed)
+
+    def fit(self,X,y=None) -> 'FakeTopicModel':
+
+        return self
+
+    def transform(self,X):
+
+        X = X.copy()
+        X['caption_class'] = self.rng.randint(0,self.nclasses,size=len(X))
+        return X
+
+    def fit_transform(self,X,y=None):
+
+        return self.fit(X).transform(X)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Helpers for generating synthetic post metadata, so that the processing stages
+#can be timed without logging in to Instagram
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+#Allow the benchmarks to be run from the package root or from this folder
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PACKAGE_ROOT not in sys.path:
+    sys.path.insert(0,PACKAGE_ROOT)
+
+
+def make_metadata_frame(nposts,nparks=50,pastdays=7,seed=0) -> pd.DataFrame:
+
+    """Generate a dataframe with the same columns as PackMetadata.process_posts"""
+
+    rng = np.random.RandomState(seed)
+    now = datetime.now()
+
+    park_names = np.array([f'park{i:03d}nps' for i in range(nparks)])
+    park_followers = rng.randint(10000,2000000,size=nparks)
+
+    park_idx = rng.randint(0,nparks,size=nposts)
+    postdate = pd.Timestamp(now) - pd.to_timedelta(rng.uniform(0,pastdays*86400,size=nposts),unit='s')
+    nfollowers = park_followers[park_idx]
+    nlikes = rng.poisson(nfollowers*0.02)
+    ncomments = rng.poisson(nfollowers*0.0005)
+
+    X = pd.DataFrame({
+        'Flocation':[f'post_database/{i}.jpg' for i in range(nposts)],
+        'caption':['A day in the park #nationalpark #nps @someone'] * nposts,
+        'credits':park_names[park_idx],
+        'postdate':postdate,
+        'timesincepost':pd.Timestamp(now) - postdate,
+        'nlikes':nlikes,
+        'ncomments':ncomments,
+        'nfollowers':nfollowers,
+        'nlikes_per_follower':nlikes/nfollowers,
+        'ncomments_per_follower':ncomments/nfollowers
+    })
+
+    return X
+
+
+def make_jpegs(directory,nimages,width=1080,height=1350,seed=0) -> list:
+
+    """Write nimages synthetic JPEGs of the given size into directory and return their paths.
+    Smooth gradients and blocks plus noise give file sizes similar to real photos"""
+
+    from PIL import Image
+
+    rng = np.random.RandomState(seed)
+    os.makedirs(directory,exist_ok=True)
+
+    yy, xx = np.mgrid[0:height,0:width]
+    paths = []
+
+    for i in range(nimages):
+        colour = rng.uniform(0,255,size=(3,3))
+        base = np.stack([colour[c,0] + colour[c,1]*xx/width - colour[c,2]*yy/height for c in range(3)],axis=-1)
+        #a few random blocks, so that the images are not all alike
+        for _ in range(8):
+            x0, y0 = rng.randint(0,width), rng.randint(0,height)
+            base[y0:y0+rng.randint(50,width//2),x0:x0+rng.randint(50,width//2)] = rng.uniform(0,255,size=3)
+        pixels = np.clip(base + rng.normal(0,12,size=base.shape),0,255).astype(np.uint8)
+        path = os.path.join(directory,f'synthetic_{i:06d}.jpg')
+        Image.fromarray(pixels).save(path,quality=90)
+        paths.append(path)
+
+    return paths
+
+
+WORDS = ['sunset','canyon','trail','river','bison','glacier','hike','snow','forest','lake','sky','peak']
+
+def make_captions(ncaptions,seed=0) -> list:
+
+    """Generate captions with a mix of hashtags (some repeated, some blacklisted, some with trailing
+    punctuation), mentions, questions, quotes and captions with no hashtags at all"""
+
+    rng = np.random.RandomState(seed)
+
+    hashtags = ['#nationalpark','#NPS','#findyourpark','#optoutside','#Friday','#leavenotrace','#wildlife',\
+        '#sunset!','#hike...','#a','#','#lawn','#Yellowstone,']
+    mentions = ['@visitor','@ranger.jane','@photo_guy!','@nps']
+    endings = ['.','!','?','...',' ','']
+
+    captions = []
+
+    for i in range(ncaptions):
+        words = list(rng.choice(WORDS,size=rng.randint(3,25)))
+        words += list(rng.choice(hashtags,size=rng.randint(0,6)))
+        words += list(rng.choice(mentions,size=rng.randint(0,3)))
+        words.insert(rng.randint(1,len(words)),rng.choice(['"wow"','$5','so.','great!','really?','\n']))
+        rng.shuffle(words)
+        captions.append(' '.join(words)+rng.choice(endings))
+
+    return captions
+
+
+def write_sidecar(path,userid,username,followers,timestamp,rng) -> None:
+
+    """Write one .json.xz sidecar in instaloader's format"""
+
+    import json
+    import lzma
+
+    caption = ' '.join(rng.choice(WORDS,size=20)) + ' #nationalpark #findyourpark @visitor'
+    shortcode = ''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz0123456789'),size=11))
+
+    node = {
+        'node':{
+            '__typename':'GraphImage',
+            'id':str(rng.randint(10**9,2**31-1)),
+            'shortcode':shortcode,
+            'dimensions':{'height':1350,'width':1080},
+            'display_url':f'https://scontent.cdninstagram.com/{shortcode}.jpg',
+            'is_video':False,
+            'edge_media_to_caption':{'edges':[{'node':{'text':caption}}]},
+            'taken_at_timestamp':int(timestamp),
+            'edge_media_preview_like':{'count':int(rng.poisson(followers*0.02))},
+            'edge_media_to_comment':{'count':int(rng.poisson(followers*0.0005))},
+            'owner':{'id':str(userid),'username':username,'edge_followed_by':{'count':int(followers)}}
+        },
+        'instaloader':{'version':'4.2.8','node_type':'Post'}
+    }
+
+    with lzma.open(path,'wt') as outfile:
+        json.dump(node,outfile)
+
+
+def make_sidecars(directory,nposts,nparks=50,pastdays=7,images=True,seed=0) -> list:
+
+    """Write nposts .json.xz sidecars in instaloader's format into directory, named like the
+    files in the post database. If images is True an empty placeholder .jpg is written next to
+    each one. Returns the sidecar paths"""
+
+    rng = np.random.RandomState(seed)
+    os.makedirs(directory,exist_ok=True)
+
+    now = datetime.now().timestamp()
+    park_ids = rng.randint(10**8,2**31-1,size=nparks)
+    park_followers = rng.randint(10000,2000000,size=nparks)
+
+    paths = []
+
+    for i in range(nposts):
+
+        park = rng.randint(nparks)
+        timestamp = int(now - rng.uniform(0,pastdays*86400))
+
+        name = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d_%H-%M-%S_UTC')
+        path = os.path.join(directory,f'{park_ids[park]}_{name}_{i}.json.xz')
+        write_sidecar(path,park_ids[park],f'park{park:03d}nps',park_followers[park],timestamp,rng)
+        if images:
+            open(path[:-len('.json.xz')]+'.jpg','wb').close()
+        paths.append(path)
+
+    return paths
+
+
+#noise shared by all the JPEGs rendered in a process, keyed by size
+_NOISE = {}
+
+def render_jpeg(path,width=1080,height=1350,seed=0) -> None:
+
+    """Write a JPEG of the given size: a smooth random colour field plus noise, which encodes
+    to about the size of a real photo and gives each seed a different perceptual hash"""
+
+    from PIL import Image
+
+    if (width,height) not in _NOISE:
+        noise = np.random.RandomState(0).normal(128,40,size=(height,width,3))
+        _NOISE[(width,height)] = Image.fromarray(np.clip(noise,0,255).astype(np.uint8))
+
+    colours = np.random.RandomState(seed).uniform(0,255,size=(10,8,3)).astype(np.uint8)
+    image = Image.fromarray(colours).resize((width,height),Image.BILINEAR)
+    Image.blend(image,_NOISE[(width,height)],0.12).save(path,quality=90)
+
+def _render_jpegs(jobs) -> None:
+
+    for path, width, height, seed in jobs:
+        render_jpeg(path,width,height,seed)
+
+#Written into each directory made by make_post_database, so that it can be told apart from a real one
+DATABASE_MARKER = '.synthetic_post_database'
+
+def make_post_database(directory,nposts,nparks=50,pastdays=7,width=1080,height=1350,workers=None,seed=0) -> list:
+
+    """Write a synthetic post database into directory: nposts .json.xz sidecars in instaloader's
+    format from nparks parks, each with a JPEG of the given size next to it. The JPEGs are
+    rendered across workers processes. Returns the sidecar paths"""
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    os.makedirs(directory,exist_ok=True)
+    open(os.path.join(directory,DATABASE_MARKER),'w').close()
+
+    metafiles = make_sidecars(directory,nposts,nparks=nparks,pastdays=pastdays,images=False,seed=seed)
+    jobs = [(metafile[:-len('.json.xz')]+'.jpg',width,height,seed*nposts+i) for i, metafile in enumerate(metafiles)]
+    chunks = [jobs[i:i+100] for i in range(0,len(jobs),100)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_render_jpegs,chunks))
+
+    return metafiles
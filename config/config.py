@@ -2,7 +2,7 @@
 #RMS 2019
 
 import os
-import pandas as pd
+import csv
 
 #Do we want to use a pretrained classifier
 #right now it determines people, animals, landscapes and buildings
@@ -21,18 +21,34 @@ current_dir = os.getcwd()
 PACKAGE_ROOT = current_dir
 DATASETS = PACKAGE_ROOT+'/data'
 MODELS = PACKAGE_ROOT+'/classifiers'
+#Created by the first download if it doesn't exist
 POSTS = PACKAGE_ROOT+'/post_database'
 
-#Ensure this important folder exists
-if not os.path.isdir(POSTS):
-	os.mkdir(POSTS)
-
 if USE_CLASSIFIER == True:
 	#CLASSIFIERPATH = MODELS+'/NP_insta_model_v1.pkl'
 	CLASSIFIERPATH = MODELS+'/NP_insta_model_v2.pkl'
+	#TorchScript exports made by export_classifier.py (files ending .pt are loaded with torch.jit.load)
+	#CLASSIFIERPATH = MODELS+'/NP_insta_model_v2.pt'
+	#CLASSIFIERPATH = MODELS+'/NP_insta_model_v2_int8.pt'
 else:
 	CLASSIFIERPATH = None
 
+#Labelled images used by export_classifier.py to check an exported classifier, in a folder
+#for each of IMAGE_CLASSES
+CLASSIFIER_HOLDOUT = DATASETS+'/classifier_holdout'
+
+#Image classification settings: images per forward pass, threads used to decode
+#and resize images, and threads used by torch (None keeps the torch default)
+CLASSIFIER_BATCH_SIZE = 16
+CLASSIFIER_WORKERS = 4
+TORCH_THREADS = None
+
+#How JPEGs are decoded for the classifier: 'full' decodes every pixel, 'quality' lets the decoder
+#scale the image down to no less than twice the model input size, and 'speed' to no less than the
+#input size. The image is then resized to the input size as before. Compare the accuracy of each on
+#the labelled holdout set with benchmarks/bench_jpeg_decode.py --holdout before changing this
+CLASSIFIER_DECODE = 'full'
+
 #NLP models
 # - count vectorizer and LDA model
 CV_MODEL = MODELS+'/cv_basemodel.pkl'
@@ -54,6 +70,11 @@ if USE_CLASSIFIER == False:
 	POST_FREQ = 24
 	DL_FREQ = 48
 
+#number of posts scheduled after each download (enough to last until the one after next),
+#and the most of those that can come from the same park
+POST_QUEUE_SIZE = max(1,2*DL_FREQ//POST_FREQ)
+MAX_QUEUED_PER_PARK = 1
+
 #weightings for generating the image ranks
 LIKES_WEIGHT = 1
 COMMENT_WEIGHT = 1
@@ -65,22 +86,77 @@ MAX_PROFILE_DL = 10
 # number will lead to more 'up to date' posts, but fewer of them
 PAST_DAYS_DL = 7
 
+# number of profiles to download from at once, and the rate limit shared by all of
+# them: an average of DL_RATE requests per second with bursts of up to DL_BURST
+DL_WORKERS = 4
+DL_RATE = 0.5
+DL_BURST = 5
+
+# number of times a failed profile lookup is retried, and the delay in seconds before the
+# first retry (doubled for each retry after that)
+REQUEST_RETRIES = 3
+REQUEST_BACKOFF = 2.0
+
+# date of the newest post downloaded from each profile, so that each download only
+# fetches posts that are new since the last one
+DL_HIGH_WATER = DATASETS+'/download_high_water.csv'
+
 #list of features that we expect to be created by FeatureGenerator
 GENERATED_FEATURES = ['credits','nlikes','ncomments','nfollowers','nlikes_per_follower','ncomments_per_follower']
 
+#Images narrower than this (in pixels) will not be posted
+MIN_IMAGE_WIDTH = 800
+
 #Hashtags that will disqualify an image 
 HASHTAG_QC = ['monday','tuesday','wednesday','thursday','friday','saturday','sunday','protect','law','notrace','litter','invasive']
 
 #Various files that the program uses
 
+#Old tab separated log of park profile snapshots. It is imported into PROFILE_STORE the first time that is opened
 PROFILE_LOGGER = DATASETS+'/profile_log.csv'
 
+#Snapshots of the park profiles taken by ProfileManip.ExtractParkStats
+PROFILE_STORE = DATASETS+'/profile_log.db'
+
+#Old CSV ledger of posted images. It is imported into POST_LEDGER the first time that is opened
 PREV_POSTS = DATASETS+'/used_image_files.csv'
 
-#Generate this important file if it doesn't already exist
-if not os.path.exists(PREV_POSTS):
+#Ledger of everything that has been posted, keyed by the hash of the image contents
+POST_LEDGER = DATASETS+'/post_ledger.db'
+
+#Posts waiting to be posted, in order
+POST_QUEUE = DATASETS+'/post_queue.db'
+
+#Cache of image content hashes
+CONTENT_HASH_CACHE = DATASETS+'/content_hash_cache.db'
+
+#Cache of perceptual image hashes, and the largest Hamming distance (out of 64 bits) at
+#which two images are treated as near duplicates
+PHASH_CACHE = DATASETS+'/phash_cache.db'
+PHASH_MAX_DISTANCE = 4
+
+#Cache of image dimensions, so that the size QC only opens new images
+IMAGE_SIZE_CACHE = DATASETS+'/image_size_cache.db'
+
+#Cache of image and caption classifications, so that the models only see new posts
+CLASSIFICATION_CACHE = DATASETS+'/classification_cache.db'
+
+#Index of post metadata, updated as posts are downloaded
+METADATA_INDEX = DATASETS+'/metadata_index.db'
+
+#Per-stage timings, row counts and memory use of each download and posting cycle, as JSON lines,
+#and optionally as a Prometheus text file (None to turn that off)
+METRICS_LOG = DATASETS+'/metrics.jsonl'
+METRICS_PROM = None
+
+#Directory where a snapshot of each posting cycle is saved, so that it can be replayed offline
+#with replay.py (None to turn recording off)
+RECORD_DIR = None
 
-	os.system('touch %s' %PREV_POSTS)
+#Sidecar scanning: number of worker processes (1 parses everything in the calling process)
+#and the number of sidecars handed to a worker at a time
+SCAN_WORKERS = os.cpu_count()
+SCAN_CHUNKSIZE = 256
 
 #CAPTIONS = {'animals':DATASETS+'/captions_list_animals.csv',\
 #'buildings':DATASETS+'/captions_list_buildings.csv',\
@@ -95,11 +171,12 @@ TAGS = DATASETS+'/tags_list.csv'
 MYPROFILELOG = DATASETS + '/myprofiledata.dat'
 
 #Read username and password
-upass = pd.read_csv(DATASETS+'/upass.csv',names=['uname','pass','id'])
+with open(DATASETS+'/upass.csv',newline='') as upass_file:
+	upass = next(csv.reader(upass_file))
 
-INSTA_UNAME = upass.iloc[0]['uname']
-INSTA_PASS =  upass.iloc[0]['pass']
-INSTA_ID = upass.iloc[0]['id']
+INSTA_UNAME = upass[0]
+INSTA_PASS =  upass[1]
+INSTA_ID = int(upass[2])
 
 #Tag line information used in every post
 TAG_LINE_1 = "Inspirational Landscapes is a personal blog and not affiliated with the government."
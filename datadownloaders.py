@@ -1,81 +1,190 @@
 #!/usr/bin/env python 
 #RMS 2019
 
-import instaloader
 import pandas as pd
 import numpy as np
 import glob
 import os
 from datetime import datetime, timedelta
-from sklearn.base import BaseEstimator, TransformerMixin
 from config import config
 import shutil
+import sqlite3
+import lzma
+import json
+import re
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from ratelimit import TokenBucket
+from instrumentation import instrumented
+import time
+import ProfileManip as pm
+import imageutils as iu
+from ledger import PostLedger
+
+HASHTAG_REGEX = re.compile(r'#(\w+)')
+
+def image_path(metafile) -> str:
+
+    """Path of the image that belongs to a .json.xz sidecar"""
+
+    return metafile[:-len('.json.xz')]+'.jpg'
+
+def read_sidecar(metafile) -> dict:
+
+    """Decode a post's .json.xz sidecar (as written by instaloader) directly, without an
+    instaloader context or any network access. credits and nfollowers are None if the stored
+    owner profile does not include them"""
+
+    with lzma.open(metafile,'rt') as infile:
+        node = json.load(infile)['node']
+
+    if 'edge_media_to_caption' in node:
+        edges = node['edge_media_to_caption']['edges']
+        caption = edges[0]['node']['text'] if edges else ''
+    else:
+        caption = node.get('caption') or ''
+
+    comments = node.get('edge_media_to_parent_comment',node.get('edge_media_to_comment',{}))
+    owner = node.get('owner',{})
+
+    return {
+        'userid':str(owner.get('id')),
+        'credits':owner.get('username'),
+        'caption':caption,
+        'hashtags':[tag.lower() for tag in HASHTAG_REGEX.findall(caption)],
+        'postdate':datetime.fromtimestamp(node.get('taken_at_timestamp',node.get('date'))),
+        'nlikes':node.get('edge_media_preview_like',node.get('edge_liked_by',{})).get('count'),
+        'ncomments':comments.get('count'),
+        'nfollowers':owner.get('edge_followed_by',{}).get('count')
+    }
+
+def read_post_metadata(metafile,profiles) -> dict:
+
+    """read_sidecar, with the owner's name and follower count filled in from profiles
+    (see ProfileManip.latest_profile_stats) when they are not stored in the sidecar"""
+
+    record = read_sidecar(metafile)
+    name, followers = profiles.get(record['userid'],(None,None))
+
+    if record['credits'] is None:
+        record['credits'] = name
+    if record['nfollowers'] is None:
+        record['nfollowers'] = followers
+
+    return record
+
+
+def _parse_chunk(parser,metafiles) -> list:
+
+    """Worker task for scan_sidecars. Failures are returned as messages rather than raised,
+    so that one bad file does not lose the rest of the chunk"""
+
+    results = []
+    for metafile in metafiles:
+        try:
+            results.append((metafile,parser(metafile),None))
+        except Exception as e:
+            results.append((metafile,None,str(e)))
+
+    return results
+
+def scan_sidecars(metafiles,parser=read_sidecar,workers=config.SCAN_WORKERS,chunksize=config.SCAN_CHUNKSIZE):
+
+    """Parse sidecars across a pool of worker processes, yielding (metafile, record) pairs
+    as each chunk completes. Files that cannot be parsed are reported and skipped"""
+
+    metafiles = list(metafiles)
+    chunks = [metafiles[i:i+chunksize] for i in range(0,len(metafiles),chunksize)]
+
+    if (workers is None or workers > 1) and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_parse_chunk,parser,chunk) for chunk in chunks]
+            results = (future.result() for future in as_completed(futures))
+            yield from _report_failures(results)
+    else:
+        yield from _report_failures(_parse_chunk(parser,chunk) for chunk in chunks)
+
+def _report_failures(chunk_results):
+
+    for results in chunk_results:
+        for metafile, record, error in results:
+            if error is None:
+                yield metafile, record
+            else:
+                print(f'Could not read metadata from {metafile}: {error}')
+
+
+def _move(source,destination) -> None:
+
+    try:
+        os.replace(source,destination)
+    except OSError:
+        #source and destination are on different filesystems
+        shutil.move(source,destination)
+
+def repo_version(repo=config.POSTS) -> str:
+
+    """The version of the post database that repo points to, which changes each time
+    DownloadNewPosts swaps in new posts. None while the repo is still a plain directory"""
+
+    return os.readlink(repo) if os.path.islink(repo) else None
+
 
 class RemoveOldPosts():
 
-    """Looks though downloaded posts and removes those older than given number of days"""
+    """Looks though downloaded posts and the post repo and removes those older than given number of days"""
 
     def __init__(self,\
         profile_list=config.PROFILES_TO_DOWNLOAD,\
         pastdays=config.PAST_DAYS_DL,\
-        used_files=config.PREV_POSTS,
-        username=config.INSTA_UNAME,
-        password=config.INSTA_PASS) -> None:
+        ledger=config.POST_LEDGER,\
+        repo=config.POSTS) -> None:
 
         profile_list = pd.read_csv(profile_list,names=['profile_name','profile_id'])
         self.profile_list = list(profile_list['profile_id'])   
 
         self.pastdays = pastdays  
         self.now = datetime.now()
-        self.used_files = used_files
-        self.L = instaloader.Instaloader(quiet=True)
-        self.username=username
-        self.password=password
-
+        self.ledger = ledger
+        self.repo = repo
 
+    @instrumented('remove_old_posts')
     def removeoldposts(self) -> None:
 
         self._removeloop()
 
     def removepreviousposts(self) -> None:
 
-        prev_posts = pd.read_csv(self.used_files,names=['filename','post_date'])
-        self.prev_posts = list(prev_posts['filename']) 
-
         self._remove_old_posts()
 
     def _removeloop(self) -> None:
 
-        self.L.login(user=self.username,passwd=self.password)
-
+        metafiles = []
         for profileid in self.profile_list:
+            metafiles.extend(postmeta for postmeta in glob.glob(f'{profileid}/*.json.xz') \
+                if os.path.isfile(image_path(postmeta)))
 
-            posts_data = glob.glob(f'{profileid}/*.json.xz')
-            
-            for postmeta in posts_data:
-                
-                post_name = postmeta.split('.')[0]
-                post_image_name = post_name+'.jpg'
-                
-                if os.path.isfile(post_image_name):
-
-                    metadata = instaloader.load_structure_from_file(context=self.L.context,\
-                        filename=postmeta)
+        #The repo is kept between downloads, so outdated posts have to be removed from it too
+        metafiles.extend(glob.glob(self.repo+'/*.json.xz'))
 
-                    #get the date of of the post
-                    postdate = metadata.date
+        for postmeta, record in scan_sidecars(metafiles):
 
-                    post_age = self.now - postdate
-                    if post_age.days > self.pastdays:
-                        for f in glob.glob(f"{post_name}*"):
-                            #print(f'Deleting {f}: Post outdated')
-                            os.remove(f)
+            post_age = self.now - record['postdate']
+            if post_age.days > self.pastdays:
+                post_name = postmeta[:-len('.json.xz')]
+                for f in glob.glob(f"{post_name}*"):
+                    #print(f'Deleting {f}: Post outdated')
+                    os.remove(f)
 
     def _remove_old_posts(self) -> None:
 
-        '''Remove image files that are known to have already been posted'''
+        '''Remove image files that are known to have already been posted. Each ledger entry
+        is only dealt with once'''
+
+        ledger = PostLedger(self.ledger)
+        entries = ledger.uncleaned()
 
-        for image_file in self.prev_posts:
+        for entry_id, image_file in entries:
 
             if os.path.exists(image_file):
 
@@ -86,203 +195,381 @@ class RemoveOldPosts():
 
                 print(f"Tried to delete {image_file}, but file not found!")
 
+        ledger.mark_cleaned([entry_id for entry_id, image_file in entries])
+        ledger.close()
+
 
 
 class DownloadNewPosts():
 
     """Connect to Instagram and get post data from specified profiles"""
 
+    #The most posts a profile can pin to the top of its feed
+    MAX_PINNED = 3
+
     def __init__(self, username=config.INSTA_UNAME,password=config.INSTA_PASS,\
         profile_list=config.PROFILES_TO_DOWNLOAD,\
         download_dir=config.DATASETS,\
         maxdownloadsperprofile=config.MAX_PROFILE_DL,\
-        pastdays=config.PAST_DAYS_DL,repo=config.POSTS) -> None:
+        pastdays=config.PAST_DAYS_DL,repo=config.POSTS,index=config.METADATA_INDEX,\
+        profile_store=config.PROFILE_STORE,workers=config.DL_WORKERS,\
+        rate=config.DL_RATE,burst=config.DL_BURST,loader=None,profile_lookup=None,\
+        high_water=config.DL_HIGH_WATER) -> None:
+
+        """loader and profile_lookup default to instaloader.Instaloader and
+        instaloader.Profile.from_id, and can be replaced with local stand-ins for testing"""
 
         self.profile_list = pd.read_csv(profile_list,names=['profile_name','profile_id'])
         self.profile_list = list(self.profile_list['profile_id'])
         self.download_dir = download_dir
         self.maxdownloadsperprofile = maxdownloadsperprofile
         self.pastdays = pastdays
-        self.L = instaloader.Instaloader(quiet=False,download_videos=False)
+
+        if loader is None or profile_lookup is None:
+            import instaloader
+        if loader is None:
+            loader = instaloader.Instaloader(quiet=False,download_videos=False)
+        if profile_lookup is None:
+            profile_lookup = instaloader.Profile.from_id
+
+        self.L = loader
+        self.profile_lookup = profile_lookup
 
         self.username = username
         self.password = password
         self.repo = repo
+        self.index = index
+        self.profile_store = profile_store
+        self.workers = workers
+        self.high_water_file = high_water
+
+        #Shared by all the download threads, to stay under Instagram's rate limits
+        self.rate_limit = TokenBucket(rate,burst)
 
+    @instrumented('download')
     def download(self) -> None:
-        """Do the download across all profiles"""
+        """Do the download across all profiles. We log in once and the download threads
+        share the session"""
 
-        for id_number in self.profile_list:
+        self.now = datetime.now()
+        self.high_water = self._load_high_water()
+
+        #New as of Aug 2019 - need to log in for better download
+        self.L.login(user=self.username,passwd=self.password)
+
+        t0 = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+
+            futures = {pool.submit(self._download_recent_posts,profile_id):profile_id \
+                for profile_id in self.profile_list}
+
+            for ndone, future in enumerate(as_completed(futures),1):
 
-            self._download_recent_posts(id_number)
+                profile_id = futures[future]
+
+                try:
+                    ndownloaded, elapsed = future.result()
+                    print(f'[{ndone}/{len(futures)}] {profile_id}: downloaded {ndownloaded} posts in {elapsed:.1f} seconds')
+                except Exception as e:
+                    print(f'[{ndone}/{len(futures)}] {profile_id}: download failed ({e})')
+
+        t1 = time.time()
+        print(f'Downloaded from {len(self.profile_list)} profiles in {t1-t0:.1f} seconds')
 
         self._move_to_repo()
 
-    def _download_recent_posts(self,profile_id) -> None:
-        """For downloading insta posts from one profile"""
+        #Only once the new posts are in the repo, so that a failed move means they are downloaded again
+        self._save_high_water()
 
-        self.now = datetime.now()
+        self._update_index()
 
-        #New as of Aug 2019 - need to log in for better download
-        self.L.login(user=self.username,passwd=self.password)
+    def _download_recent_posts(self,profile_id) -> tuple:
+        """For downloading insta posts from one profile. Returns the number of posts
+        downloaded and the time taken"""
+
+        t0 = time.time()
 
-        posts = instaloader.Profile.from_id(context=self.L.context,profile_id=str(profile_id)).get_posts()
+        self.rate_limit.acquire()
+        posts = self.profile_lookup(self.L.context,str(profile_id)).get_posts()
     
+        #The feed is newest first apart from pinned posts, which come at the top whatever their age. Old or
+        #already downloaded posts are skipped, and we stop at the first of them that is not pinned
+        high_water = self.high_water.get(str(profile_id))
+        newest = None
+        failed = False
+
         i = 0
+        ndownloaded = 0
         for post in posts:
-            if i < self.maxdownloadsperprofile:
-                tsince = self.now - post.date
-
-                if tsince.days <= self.pastdays:
-                    #print(post,profile_id)
-                    try:
-                        self.L.download_post(post,str(profile_id))
-                    except:
-                        print('Could not download post %s for profile %i' (post,profileid))
-
-                #Remove all in the download directory and redownload
-                #os.system('rm -rf %s/*' %self.download_dir)
-                #os.system('mv -f %s %s' %(profile_id,self.download_dir))
-                i += 1
-            else:
+
+            if i >= self.maxdownloadsperprofile:
+                break
+            i += 1
+
+            known = high_water is not None and post.date_utc <= high_water
+            outdated = (self.now - post.date).days > self.pastdays
+
+            if known or outdated:
+                #older versions of instaloader can't tell, so any of the first MAX_PINNED posts might be pinned
+                pinned = getattr(post,'is_pinned',None)
+                if pinned is None:
+                    pinned = i <= self.MAX_PINNED
+                if pinned:
+                    continue
                 break
 
-    def _move_to_repo(self) -> None:
+            if newest is None or post.date_utc > newest:
+                newest = post.date_utc
 
-        '''Generate a repository that contains material to be considered for posting'''
+            if not os.path.isfile(self._repo_image_name(profile_id,post)):
+                self.rate_limit.acquire()
+                try:
+                    self.L.download_post(post,str(profile_id))
+                    ndownloaded += 1
+                except Exception as e:
+                    print(f'Could not download post {post} for profile {profile_id}: {e}')
+                    failed = True
 
-        #regenerate the repo directory. This is needed so that the system does not post the duplicate files
+        #Only move the mark on if nothing was missed, so that failed posts are tried again next time
+        if newest is not None and not failed:
+            self.high_water[str(profile_id)] = newest
 
-        print("Removing and remaking post database")
+        return ndownloaded, time.time() - t0
 
-        try:
-            shutil.rmtree(self.repo)
-            os.mkdir(self.repo)
-        except:
-            print('Cannnot remove repo at the present time - it is likely being used by another script')
+    def _repo_image_name(self,profile_id,post) -> str:
+
+        """Where a post's image ends up in the repo (instaloader names files after the UTC post date)"""
+
+        return f"{self.repo}/{profile_id}_{post.date_utc:%Y-%m-%d_%H-%M-%S}_UTC.jpg"
+
+    def _load_high_water(self) -> dict:
+
+        """Date (UTC) of the newest post already downloaded from each profile"""
+
+        if not os.path.isfile(self.high_water_file):
+            return {}
 
+        marks = pd.read_csv(self.high_water_file,dtype={'profile_id':str},parse_dates=['date_utc'])
+
+        return {profile_id:date.to_pydatetime() for profile_id, date in zip(marks['profile_id'],marks['date_utc'])}
+
+    def _save_high_water(self) -> None:
+
+        marks = pd.DataFrame({'profile_id':list(self.high_water.keys()),'date_utc':list(self.high_water.values())})
+        marks.to_csv(self.high_water_file,index=False)
+
+    @instrumented('download.move_to_repo')
+    def _move_to_repo(self) -> None:
+
+        '''Build the next version of the repository of material to be considered for posting in a staging
+        directory, then swap it in all at once, so that readers never see a partial inventory. Posts already
+        in the repo are hard linked into the new version (they are kept until RemoveOldPosts finds them
+        outdated) and new downloads are moved in with os.replace'''
+
+        new_posts = []
         for profileid in self.profile_list:
 
-            posts_data = glob.glob(f'{profileid}/*.json.xz')
-            
-            for postmeta in posts_data:
-                
-                post_name = postmeta.split('.')[0]
-                post_image_name = post_name+'.jpg'
+            for postmeta in glob.glob(f'{profileid}/*.json.xz'):
+
+                post_image_name = image_path(postmeta)
 
-                print(post_image_name)
-                
                 if os.path.isfile(post_image_name):
+                    new_posts.append((profileid,postmeta,post_image_name))
+                else:
+                    print(f'Image for {postmeta} not found')
 
-                    post_meta_name_new = self.repo + '/' + str(profileid) + '_' + postmeta.split('/')[1]
-                    post_image_name_new = self.repo + '/' + str(profileid) + '_' + post_image_name.split('/')[1]
+        versions = self.repo + '_versions'
+        os.makedirs(versions,exist_ok=True)
 
-                    print(post_image_name,post_image_name_new)
-                    print(postmeta,post_meta_name_new)
+        #Left behind by a move that failed part way. The posts moved into them are downloaded again,
+        #as the high water marks were not saved
+        for name in os.listdir(versions):
+            if name.startswith('staging_'):
+                shutil.rmtree(os.path.join(versions,name),ignore_errors=True)
 
-                    print('moving files')
-                    os.system('mv %s %s' %(post_image_name,post_image_name_new))
-                    os.system('mv %s %s' %(postmeta,post_meta_name_new))
+        if not new_posts:
+            print('Moved 0 new posts into the post database')
+            return
 
-                else:
+        #makedirs (unlike mkdtemp) honours the umask, as this becomes the repo
+        staging = os.path.join(versions,f'staging_{os.getpid()}_{datetime.now():%Y%m%d-%H%M%S-%f}')
+        os.makedirs(staging)
+
+        if os.path.isdir(self.repo):
+            for entry in os.scandir(self.repo):
+                if entry.is_file():
+                    iu.link_or_copy(entry.path,os.path.join(staging,entry.name))
+
+        nmoved = 0
+        for profileid, postmeta, post_image_name in new_posts:
+            for source in (post_image_name,postmeta):
+                _move(source,os.path.join(staging,f'{profileid}_{os.path.basename(source)}'))
+            nmoved += 1
+
+        version = os.path.join(versions,datetime.now().strftime('%Y%m%d-%H%M%S-%f'))
+        os.rename(staging,version)
+        self._swap_repo(version)
+
+        print(f'Moved {nmoved} new posts into the post database')
+
+    def _swap_repo(self,version) -> None:
+
+        '''Point the repo symlink at version with a single rename, then remove all but the
+        previous version (which a reader may still be part way through)'''
+
+        versions = os.path.dirname(version)
+
+        #The first time through the repo is a plain directory. Move it aside so that it can become a symlink
+        if os.path.isdir(self.repo) and not os.path.islink(self.repo):
+            os.rename(self.repo,os.path.join(versions,'0-initial'))
+
+        link = self.repo + '.link'
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.relpath(version,os.path.dirname(os.path.abspath(self.repo))),link)
+        os.replace(link,self.repo)
+
+        old_versions = sorted(name for name in os.listdir(versions) if not name.startswith('staging_'))
+        for name in old_versions[:-2]:
+            shutil.rmtree(os.path.join(versions,name),ignore_errors=True)
+
+    @instrumented('download.update_index')
+    def _update_index(self) -> None:
+
+        '''Parse the metadata of the posts that have just landed, so that PackMetadata does not have to'''
+
+        profiles = pm.latest_profile_stats(self.profile_store)
+
+        index = MetadataIndex(self.index)
+        nparsed = index.update(glob.glob(self.repo+'/*.json.xz'),partial(read_post_metadata,profiles=profiles))
+        index.close()
 
-                    print('file not found')
+        print(f'Indexed metadata of {nparsed} new posts')
 
 
 
 
+class MetadataIndex():
+
+    """Persistent index of post metadata, so that each sidecar is only parsed once. A row is
+    refreshed when its sidecar's modification time changes, and dropped when the sidecar or
+    its image leaves the repo"""
+
+    def __init__(self,dbfile=config.METADATA_INDEX) -> None:
+
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile)
+
+        #Indexes written before the owner's userid was recorded are rebuilt from scratch
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(posts)')]
+        if columns and 'userid' not in columns:
+            with self.conn:
+                self.conn.execute('DROP TABLE posts')
+
+        self.conn.execute('CREATE TABLE IF NOT EXISTS posts (metafile TEXT PRIMARY KEY, mtime REAL, '
+            'Flocation TEXT, caption TEXT, credits TEXT, postdate TEXT, nlikes INTEGER, ncomments INTEGER, '
+            'nfollowers INTEGER, userid TEXT)')
+
+    def close(self) -> None:
+
+        self.conn.close()
+
+    def update(self,metafiles,parser,workers=config.SCAN_WORKERS,chunksize=config.SCAN_CHUNKSIZE) -> int:
+
+        """Parse the new or modified sidecars in metafiles with parser (which takes a sidecar
+        path and returns a dict like read_sidecar) using scan_sidecars. Returns the number of
+        sidecars parsed"""
+
+        known = dict(self.conn.execute('SELECT metafile,mtime FROM posts'))
+
+        current = {}
+        for metafile in metafiles:
+            try:
+                mtime = os.stat(metafile).st_mtime
+            except OSError:
+                continue
+            if os.path.isfile(image_path(metafile)):
+                current[metafile] = mtime
+
+        stale = [metafile for metafile in known if metafile not in current]
+        changed = [metafile for metafile, mtime in current.items() if known.get(metafile) != mtime]
+
+        rows = []
+        for metafile, record in scan_sidecars(changed,parser,workers=workers,chunksize=chunksize):
+            rows.append((metafile,current[metafile],image_path(metafile),record['caption'],record['credits'],\
+                str(record['postdate']),record['nlikes'],record['ncomments'],record['nfollowers'],record['userid']))
+
+        with self.conn:
+            self.conn.executemany('DELETE FROM posts WHERE metafile=?',[(metafile,) for metafile in stale])
+            self.conn.executemany('INSERT OR REPLACE INTO posts VALUES (?,?,?,?,?,?,?,?,?,?)',rows)
+
+        return len(rows)
+
+    def load(self) -> pd.DataFrame:
+
+        """Return the indexed metadata in the format produced by PackMetadata.process_posts"""
+
+        X = pd.read_sql_query('SELECT Flocation,caption,credits,postdate,nlikes,ncomments,nfollowers,userid FROM posts',\
+            self.conn,parse_dates=['postdate'])
+
+        X.insert(4,'timesincepost',datetime.now() - X['postdate'])
+        X['nlikes_per_follower'] = X['nlikes']/X['nfollowers']
+        X['ncomments_per_follower'] = X['ncomments']/X['nfollowers']
+
+        return X
+
+
 class PackMetadata():
 
     """Generate a dataframe containing metadata of the desired posts"""
 
-    def __init__(self,download_dir=config.DATASETS,repo=config.POSTS,prev_posts=config.PREV_POSTS,
-        username=config.INSTA_UNAME,password=config.INSTA_PASS) -> None:
+    def __init__(self,download_dir=config.DATASETS,repo=config.POSTS,ledger=config.POST_LEDGER,
+        index=config.METADATA_INDEX,profile_store=config.PROFILE_STORE,hash_cache=config.CONTENT_HASH_CACHE) -> None:
 
         self.download_dir = download_dir
         self.repo = repo
-        self.L = instaloader.Instaloader(quiet=True)
-        self.username=username
-        self.password=password
-        self.used_files = prev_posts
-
-    def _get_metadata(self,metadatafile) -> None:
-    
-            username = metadatafile.owner_profile.username
-            caption = metadatafile.caption
-            caption_hastags = metadatafile.caption_hashtags
-            postdate = metadatafile.date
-            time_since_postdate = datetime.now() - postdate
-            nlikes = metadatafile.likes
-
-            ncomments = metadatafile.comments
-            nfollowers = metadatafile.owner_profile.followers
-            nlikes_per_follower = nlikes/nfollowers
-            ncomments_per_follower = ncomments/nfollowers
-            
-            return [username,caption,caption_hastags,postdate,time_since_postdate,\
-                   nlikes,ncomments,nfollowers,nlikes_per_follower,ncomments_per_follower]
-        
-        
+        self.ledger = ledger
+        self.index = index
+        self.profile_store = profile_store
+        self.hash_cache = hash_cache
 
+    @instrumented('pack_metadata')
     def process_posts(self,debug=False) -> pd.DataFrame:
 
-        self.L.login(user=self.username,passwd=self.password)
+        """Everything is read from local files, so no login is needed. Follower counts come from
+        the ExtractParkStats snapshots, interpolated to the time of each post, and fall back to
+        the count stored with the post for profiles that have no snapshots"""
+
+        #Bring the index up to date with the repo, then load all metadata in one go
+
+        profiles = pm.latest_profile_stats(self.profile_store)
+
+        index = MetadataIndex(self.index)
+        nparsed = index.update(glob.glob(self.repo+'/*.json.xz'),partial(read_post_metadata,profiles=profiles))
+        X = index.load()
+        index.close()
+
+        print(f'Found {len(X)} posts ({nparsed} new or updated)')
+
+        store = pm.ProfileStore(self.profile_store)
+        followers = store.followers_at(X['userid'],X['postdate'])
+        store.close()
+
+        X['nfollowers'] = np.where(np.isnan(followers),X['nfollowers'],followers)
+        X['nlikes_per_follower'] = X['nlikes']/X['nfollowers']
+        X['ncomments_per_follower'] = X['ncomments']/X['nfollowers']
+
+        #Drop anything that has been posted before, wherever it lives now, and exact duplicates
+        ledger = PostLedger(self.ledger,hash_cache=self.hash_cache)
+        posted = ledger.posted_mask(X['Flocation'])
+        X = X[~posted].reset_index(drop=True)
+        ledger.close()
 
-        prev_posts = pd.read_csv(self.used_files,names=['filename','post_date'])
-        self.prev_posts = list(prev_posts['filename'])
-
-        
-        post_metadata = {
-            'Flocation':[],
-            'caption':[],
-            'credits':[],
-            'postdate':[],
-            'timesincepost':[],
-            'nlikes':[],
-            'ncomments':[],
-            'nfollowers':[],
-            'nlikes_per_follower':[],
-            'ncomments_per_follower':[]
-        }
-
-        #Get all metadata from the repo
-
-        allmeta = glob.glob(self.repo+'/*.json.xz')
-
-        for postmeta in allmeta:
-            
-            post_name = postmeta.split('.')[0]
-            post_image_name = post_name+'.jpg'
-            
-            if os.path.isfile(post_image_name) and post_image_name not in prev_posts:
-                
-                print(f'Found post {postmeta}')
-                
-                if debug == True:
-                    post_image = mpimg.imread(post_image_name)
-                    plt.imshow(post_image)
-                    plt.show()
-                    
-                metadata = instaloader.load_structure_from_file(context=self.L.context,\
-                    filename=postmeta)
-                
-                #metadata that is useful to us
-                metadata_list = self._get_metadata(metadata)
-                
-                if metadata_list:
-                
-                    post_metadata['Flocation'].append(post_image_name)
-                    post_metadata['credits'].append(metadata_list[0])
-                    post_metadata['caption'].append(metadata_list[1])
-                    post_metadata['postdate'].append(metadata_list[3])
-                    post_metadata['timesincepost'].append(metadata_list[4])
-                    post_metadata['nlikes'].append(metadata_list[5])
-                    post_metadata['ncomments'].append(metadata_list[6])
-                    post_metadata['nfollowers'].append(metadata_list[7])
-                    post_metadata['nlikes_per_follower'].append(metadata_list[8])
-                    post_metadata['ncomments_per_follower'].append(metadata_list[9])
-                        
-            
-        return pd.DataFrame(post_metadata)
+        self.qc_drops = {'already_posted':int(posted.sum())}
 
+        if debug == True:
+            for image_file in X['Flocation']:
+                print(f'Found post {image_file}')
 
+        return X
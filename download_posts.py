@@ -4,6 +4,7 @@
 #Download posts as part of a cron job
 
 import datadownloaders as dd
+import instrumentation
 from config import config
 import time
 
@@ -15,11 +16,13 @@ def main() -> None:
 
     download_pipe = dd.DownloadNewPosts()
 
-    remove_pipe.removeoldposts()
+    with instrumentation.cycle('download'):
 
-    print('Starting download')
+        remove_pipe.removeoldposts()
 
-    download_pipe.download()
+        print('Starting download')
+
+        download_pipe.download()
 
     print('Download complete')
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Export the pickled image classifier as TorchScript, optionally with int8 dynamic quantization of
+#its linear layers, and check it against the original on a labelled holdout set (a folder of images
+#for each class in config.CLASSIFIER_HOLDOUT). The export is removed again if it loses too much
+#accuracy. Point config.CLASSIFIERPATH at the .pt file to use it
+#python export_classifier.py [--quantize] [--output FILE]
+#Quantization needs torch 1.3 or later (requirements.txt pins 1.1), and is refused on older versions
+
+import argparse
+import glob
+import os
+import sys
+import time
+import pandas as pd
+from config import config
+import preprocessing as pp
+
+
+QUANTIZE_UNSUPPORTED = 'int8 quantization needs torch 1.3 or later (this is torch {})'
+
+
+def can_quantize() -> bool:
+
+    """Whether this version of torch has dynamic quantization"""
+
+    import torch
+
+    return hasattr(getattr(torch,'quantization',None),'quantize_dynamic')
+
+def export(model,output,quantize=False,size=224):
+
+    """Trace model to TorchScript, quantizing it first if asked, and save it to output.
+    Returns the exported model"""
+
+    import torch
+
+    model.eval()
+
+    if quantize:
+        if not can_quantize():
+            raise RuntimeError(QUANTIZE_UNSUPPORTED.format(torch.__version__))
+        #store the weights of the linear layers (most of VGG16's parameters) as int8, and
+        #quantize their inputs on the fly. The convolutions stay in fp32
+        model = torch.quantization.quantize_dynamic(model,{torch.nn.Linear},dtype=torch.qint8)
+
+    with torch.no_grad():
+        scripted = torch.jit.trace(model,torch.zeros(1,3,size,size))
+
+    torch.jit.save(scripted,output)
+
+    return scripted
+
+
+def holdout_images(holdout=config.CLASSIFIER_HOLDOUT) -> tuple:
+
+    """Image files and labels of the holdout set, laid out as holdout/<class>/<image>"""
+
+    image_files, labels = [], []
+
+    for label in config.IMAGE_CLASSES:
+        for image_file in sorted(glob.glob(os.path.join(holdout,label,'*'))):
+            image_files.append(image_file)
+            labels.append(label)
+
+    return image_files, labels
+
+
+def compare(original,exported,image_files,labels=None) -> dict:
+
+    """Classify image_files with both classifiers (paths of model files) through ContentDetermination.
+    Returns the images/sec of each, how often they agree and, given labels, their accuracy"""
+
+    X = pd.DataFrame({'Flocation':image_files})
+    results = {}
+    predictions = {}
+
+    for name, classifier in [('original',original),('exported',exported)]:
+
+        cd = pp.ContentDetermination(classifier=classifier,cache=None).fit(X)
+
+        t0 = time.perf_counter()
+        predictions[name] = cd.predict_classes(image_files)
+        t1 = time.perf_counter()
+
+        results[f'{name}_images_per_second'] = len(image_files)/(t1-t0)
+        if labels is not None:
+            results[f'{name}_accuracy'] = sum(a == b for a, b in zip(predictions[name],labels))/len(labels)
+
+    results['agreement'] = sum(a == b for a, b in zip(predictions['original'],predictions['exported']))/len(image_files)
+
+    return results
+
+
+def main() -> None:
+
+    import torch
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--classifier',default=config.CLASSIFIERPATH,help='pickled model to export')
+    parser.add_argument('--output',default=None,help='defaults to the classifier path ending in .pt (or _int8.pt)')
+    parser.add_argument('--quantize',action='store_true',help='int8 dynamic quantization of the linear layers')
+    parser.add_argument('--holdout',default=config.CLASSIFIER_HOLDOUT)
+    parser.add_argument('--max-accuracy-drop',type=float,default=0.01,
+        help='largest loss of holdout accuracy allowed before the export is rejected')
+    args = parser.parse_args()
+
+    if args.classifier is None or args.classifier.endswith('.pt'):
+        sys.exit('Give the pickled classifier to export with --classifier (or set config.CLASSIFIERPATH)')
+
+    if args.quantize and not can_quantize():
+        sys.exit(QUANTIZE_UNSUPPORTED.format(torch.__version__))
+
+    output = args.output or os.path.splitext(args.classifier)[0] + ('_int8.pt' if args.quantize else '.pt')
+
+    t0 = time.perf_counter()
+    model = pp.load_pickled_model(args.classifier)
+    export(model,output,quantize=args.quantize)
+    t1 = time.perf_counter()
+
+    print(f'Exported {args.classifier} to {output} in {t1-t0:.1f} s '
+        f'({os.path.getsize(args.classifier)/2**20:.0f} MB -> {os.path.getsize(output)/2**20:.0f} MB)')
+
+    image_files, labels = holdout_images(args.holdout)
+
+    if not image_files:
+        print(f'Warning: no holdout images found in {args.holdout}, so the export has not been checked')
+        return
+
+    results = compare(args.classifier,output,image_files,labels)
+
+    print(f"Holdout set of {len(image_files)} images: accuracy {results['original_accuracy']:.1%} (original), "
+        f"{results['exported_accuracy']:.1%} (exported), the two agree on {results['agreement']:.1%}")
+    print(f"{results['original_images_per_second']:.1f} images/sec (original), "
+        f"{results['exported_images_per_second']:.1f} images/sec (exported)")
+
+    if results['original_accuracy'] - results['exported_accuracy'] > args.max_accuracy_drop:
+        os.remove(output)
+        sys.exit(f'Export rejected: accuracy dropped by more than {args.max_accuracy_drop:.1%}')
+
+
+if __name__ == "__main__":
+
+    main()
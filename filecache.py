@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#RMS 2019
+
+import os
+import json
+import hashlib
+import sqlite3
+
+def file_checksum(*paths) -> str:
+
+    """md5 of the contents of one or more files, used to identify the model that produced
+    a set of cached results"""
+
+    md5 = hashlib.md5()
+    for path in paths:
+        with open(path,'rb') as infile:
+            for chunk in iter(lambda: infile.read(1<<20),b''):
+                md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+class FileCache():
+
+    """Persistent store of per-file results (image sizes, classifications etc). Entries are
+    keyed by path and are only returned while the file's modification time and size are unchanged.
+    If an identity is given (e.g. a model checksum) and it differs from the one the table was
+    written with, the table is cleared"""
+
+    def __init__(self,dbfile,table,identity=None) -> None:
+
+        if not table.isidentifier():
+            raise ValueError(f'Invalid cache table name {table}')
+
+        self.dbfile = dbfile
+        self.table = table
+        self.conn = sqlite3.connect(dbfile)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+            '(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, value TEXT)')
+
+        if identity is not None:
+            self._check_identity(identity)
+
+        #The tables are small, so hold them in memory and write back in one transaction
+        self.entries = {}
+        for path, mtime, size, value in self.conn.execute(f'SELECT path,mtime,size,value FROM {table}'):
+            self.entries[path] = (mtime,size,value)
+
+        self.changed = set()
+        self.removed = set()
+
+    def _check_identity(self,identity) -> None:
+
+        self.conn.execute('CREATE TABLE IF NOT EXISTS cache_identity (tablename TEXT PRIMARY KEY, identity TEXT)')
+        stored = self.conn.execute('SELECT identity FROM cache_identity WHERE tablename=?',(self.table,)).fetchone()
+
+        if stored is None or stored[0] != identity:
+            with self.conn:
+                self.conn.execute(f'DELETE FROM {self.table}')
+                self.conn.execute('INSERT OR REPLACE INTO cache_identity VALUES (?,?)',(self.table,identity))
+
+    def __enter__(self) -> 'FileCache':
+
+        return self
+
+    def __exit__(self,*args) -> None:
+
+        self.close()
+
+    @staticmethod
+    def _stamp(path) -> tuple:
+
+        stat = os.stat(path)
+        return (stat.st_mtime,stat.st_size)
+
+    def __contains__(self,path) -> bool:
+
+        entry = self.entries.get(path)
+        if entry is None:
+            return False
+        try:
+            return entry[:2] == self._stamp(path)
+        except OSError:
+            return False
+
+    def get(self,path,default=None):
+
+        """Return the stored value for path, or default if missing or out of date"""
+
+        if path in self:
+            return json.loads(self.entries[path][2])
+        return default
+
+    def set(self,path,value) -> None:
+
+        mtime, size = self._stamp(path)
+        self.entries[path] = (mtime,size,json.dumps(value))
+        self.changed.add(path)
+        self.removed.discard(path)
+
+    def evict(self,keep_paths) -> int:
+
+        """Drop entries for any file not in keep_paths. Returns the number removed"""
+
+        keep_paths = set(keep_paths)
+        stale = [path for path in self.entries if path not in keep_paths]
+        for path in stale:
+            del self.entries[path]
+            self.changed.discard(path)
+            self.removed.add(path)
+
+        return len(stale)
+
+    def evict_missing(self) -> int:
+
+        """Drop entries for files that no longer exist. Returns the number removed"""
+
+        return self.evict(path for path in self.entries if os.path.exists(path))
+
+    def commit(self) -> None:
+
+        with self.conn:
+            self.conn.executemany(f'INSERT OR REPLACE INTO {self.table} VALUES (?,?,?,?)',
+                [(path,)+self.entries[path] for path in self.changed])
+            self.conn.executemany(f'DELETE FROM {self.table} WHERE path=?',
+                [(path,) for path in self.removed])
+
+        self.changed = set()
+        self.removed = set()
+
+    def close(self) -> None:
+
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#RMS 2019
+
+class HammingIndex():
+
+    """Multi-index hashing for finding bit strings within max_distance of a query. Each hash is
+    split into max_distance+1 chunks and indexed by each chunk value; by the pigeonhole principle
+    any hash within max_distance of the query matches it exactly in at least one chunk, so only
+    those candidates need to be compared. Lookups cost roughly n/2**chunk_bits comparisons rather
+    than n"""
+
+    def __init__(self,max_distance=4,nbits=64) -> None:
+
+        self.max_distance = max_distance
+        nchunks = max_distance + 1
+
+        #chunk boundaries, as equal in size as possible
+        edges = [round(i*nbits/nchunks) for i in range(nchunks+1)]
+        self.chunks = [(edges[i],(1 << (edges[i+1]-edges[i])) - 1) for i in range(nchunks)]
+        self.tables = [{} for _ in self.chunks]
+        self.hashes = []
+
+    def __len__(self) -> int:
+
+        return len(self.hashes)
+
+    def _keys(self,value) -> list:
+
+        return [(value >> shift) & mask for shift, mask in self.chunks]
+
+    def add(self,value) -> int:
+
+        """Add a hash and return its position in the index"""
+
+        position = len(self.hashes)
+        self.hashes.append(value)
+        for table, key in zip(self.tables,self._keys(value)):
+            table.setdefault(key,[]).append(position)
+
+        return position
+
+    def query(self,value) -> list:
+
+        """Positions of all indexed hashes within max_distance of value"""
+
+        candidates = set()
+        for table, key in zip(self.tables,self._keys(value)):
+            candidates.update(table.get(key,()))
+
+        return [position for position in candidates \
+            if bin(self.hashes[position] ^ value).count('1') <= self.max_distance]
+
+    def has_near(self,value) -> bool:
+
+        for table, key in zip(self.tables,self._keys(value)):
+            for position in table.get(key,()):
+                if bin(self.hashes[position] ^ value).count('1') <= self.max_distance:
+                    return True
+
+        return False
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Image helpers that avoid decoding more pixels than are needed
+
+import os
+import shutil
+import numpy as np
+from PIL import Image
+
+def link_or_copy(source,destination) -> None:
+
+    """Hard link source (usually an image) to destination, copying it if that is not possible"""
+
+    try:
+        os.link(source,destination)
+    except OSError:
+        shutil.copy2(source,destination)
+
+def image_dimensions(image_loc) -> tuple:
+
+    """Return (height, width, bands) read from the image header only. The pixel
+    data is never decoded. Returns None if the file cannot be read as an image"""
+
+    try:
+        with Image.open(image_loc) as img:
+            width, height = img.size
+            #palette images are expanded to RGBA when decoded
+            nbands = 4 if img.mode == 'P' else len(img.getbands())
+    except (OSError,SyntaxError,ValueError):
+        return None
+
+    return (height,width,nbands)
+
+def dhash(image_loc,hash_size=8) -> int:
+
+    """Difference hash of an image as a hash_size*hash_size bit integer. Similar images (resized,
+    recompressed, lightly cropped or edited) have hashes a small Hamming distance apart.
+    Returns None if the file cannot be read as an image"""
+
+    try:
+        with Image.open(image_loc) as img:
+            #Let the JPEG decoder scale down while decoding; we only need a tiny greyscale image
+            img.draft('L',(hash_size*8,hash_size*8))
+            small = img.convert('L').resize((hash_size+1,hash_size),Image.LANCZOS)
+    except (OSError,SyntaxError,ValueError):
+        return None
+
+    pixels = np.asarray(small,dtype=np.int16)
+    bits = (pixels[:,1:] > pixels[:,:-1]).flatten()
+
+    return int.from_bytes(np.packbits(bits).tobytes(),'big')
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Per-stage measurements for the download and posting cycles: wall and CPU time, rows in and
+#out, rows dropped by each QC step and peak memory. The records for a cycle are appended to
+#config.METRICS_LOG as JSON lines and, if config.METRICS_PROM is set, written as a Prometheus
+#text file (e.g. for the node exporter's textfile collector)
+
+import os
+import sys
+import json
+import time
+import uuid
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+from config import config
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#The cycle currently being recorded, if any
+_active = None
+
+
+def _reset_peak_rss() -> None:
+
+    """Reset the kernel's peak RSS counter so the next reading covers only what follows (Linux only)"""
+
+    try:
+        with open('/proc/self/clear_refs','w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+def _peak_rss() -> int:
+
+    """Peak resident set size of this process in bytes"""
+
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+
+    #ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss*1024
+
+def _nrows(data) -> int:
+
+    return len(data) if hasattr(data,'columns') else None
+
+
+class CycleMetrics():
+
+    """Records of the stages run during one download or posting cycle"""
+
+    def __init__(self,kind,jsonl=config.METRICS_LOG,prometheus=config.METRICS_PROM) -> None:
+
+        self.kind = kind
+        self.jsonl = jsonl
+        self.prometheus = prometheus
+        self.cycle_id = uuid.uuid4().hex[:12]
+        self.started = datetime.now()
+        self.records = []
+        self._open = []
+
+    @contextmanager
+    def stage(self,name,rows_in=None):
+
+        """Measure the enclosed block. Yields the record, so that rows_out and qc_drops can be filled in"""
+
+        record = {'cycle':self.cycle_id,'kind':self.kind,'stage':name,'started':str(datetime.now()),\
+            'rows_in':rows_in,'rows_out':None,'qc_drops':{}}
+
+        self._open.append(record)
+        _reset_peak_rss()
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall0
+            record['cpu_seconds'] = time.process_time() - cpu0
+            #a nested stage resets the peak, so take the larger of ours and theirs
+            record['peak_rss_bytes'] = max(filter(None,[_peak_rss(),record.pop('_child_peak',None)]),default=None)
+            self._open.pop()
+            if self._open:
+                parent = self._open[-1]
+                parent['_child_peak'] = max(filter(None,[parent.get('_child_peak'),record['peak_rss_bytes']]),default=None)
+            self.records.append(record)
+
+    def write(self) -> None:
+
+        """Append the records to the JSON lines log, and rewrite the Prometheus file"""
+
+        if self.jsonl:
+            with open(self.jsonl,'a') as outfile:
+                for record in self.records:
+                    outfile.write(json.dumps(record,default=str)+'\n')
+
+        if self.prometheus:
+            self._write_prometheus()
+
+    def _write_prometheus(self) -> None:
+
+        metrics = {
+            'wall_seconds':'Wall clock time of the stage',
+            'cpu_seconds':'CPU time of the process (all threads) during the stage',
+            'rows_in':'Rows passed into the stage',
+            'rows_out':'Rows coming out of the stage',
+            'peak_rss_bytes':'Peak resident memory during the stage'
+        }
+
+        lines = []
+
+        for metric, description in metrics.items():
+            lines.append(f'# HELP npbot_stage_{metric} {description}')
+            lines.append(f'# TYPE npbot_stage_{metric} gauge')
+            for record in self.records:
+                if record.get(metric) is not None:
+                    lines.append(f'npbot_stage_{metric}{{kind="{self.kind}",stage="{record["stage"]}"}} {record[metric]}')
+
+        lines.append('# HELP npbot_stage_qc_dropped_rows Rows removed by each QC step')
+        lines.append('# TYPE npbot_stage_qc_dropped_rows gauge')
+        for record in self.records:
+            for reason, count in record['qc_drops'].items():
+                lines.append(f'npbot_stage_qc_dropped_rows{{kind="{self.kind}",stage="{record["stage"]}",reason="{reason}"}} {count}')
+
+        lines.append(f'npbot_cycle_timestamp_seconds{{kind="{self.kind}"}} {self.started.timestamp()}')
+
+        #write then rename, so that a scraper never sees half a file
+        tmpfile = self.prometheus + '.tmp'
+        with open(tmpfile,'w') as outfile:
+            outfile.write('\n'.join(lines)+'\n')
+        os.replace(tmpfile,self.prometheus)
+
+
+@contextmanager
+def cycle(kind,**kwargs):
+
+    """Record the instrumented stages run inside this block as one cycle, and write them out at
+    the end. Inside an existing cycle this just continues that one"""
+
+    global _active
+
+    if _active is not None:
+        yield _active
+        return
+
+    _active = CycleMetrics(kind,**kwargs)
+    try:
+        yield _active
+    finally:
+        metrics, _active = _active, None
+        metrics.write()
+
+@contextmanager
+def stage(name,rows_in=None):
+
+    """Measure a block as a stage of the current cycle (does nothing outside a cycle)"""
+
+    if _active is None:
+        yield {}
+    else:
+        with _active.stage(name,rows_in) as record:
+            yield record
+
+def instrumented(name):
+
+    """Decorator that measures a method as a stage of the current cycle. Rows in and out are
+    recorded when the first argument or the result is a dataframe, and QC drops are taken
+    from the qc_drops attribute of the object, if the method sets one"""
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(self,*args,**kwargs):
+
+            if _active is None:
+                return method(self,*args,**kwargs)
+
+            with stage(name,_nrows(args[0]) if args else None) as record:
+                self.qc_drops = {}
+                result = method(self,*args,**kwargs)
+                record['rows_out'] = _nrows(result)
+                record['qc_drops'] = dict(self.qc_drops)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+def run_steps(steps,X):
+
+    """fit_transform each (name, stage) of a pipeline in turn, measuring each one. Returns the
+    output of the last stage"""
+
+    for name, step in steps:
+
+        with stage(f'process_pipe.{name}',_nrows(X)) as record:
+            step.qc_drops = {}
+            X = step.fit_transform(X)
+            record['rows_out'] = _nrows(X)
+            record['qc_drops'] = dict(step.qc_drops)
+
+    return X
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#RMS 2019
+
+import os
+import hashlib
+import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from config import config
+from filecache import FileCache
+import imageutils as iu
+
+def content_hashes(image_files,cachefile=config.CONTENT_HASH_CACHE) -> list:
+
+    """sha1 of the contents of each image (None if it cannot be read). Hashes are cached by
+    path, mtime and size so each image is only read once"""
+
+    hashes = []
+
+    with FileCache(cachefile,'content_hash') as cache:
+
+        cache.evict_missing()
+
+        for image_file in image_files:
+
+            image_hash = cache.get(image_file)
+
+            if image_hash is None:
+                try:
+                    with open(image_file,'rb') as infile:
+                        image_hash = hashlib.sha1(infile.read()).hexdigest()
+                except OSError:
+                    hashes.append(None)
+                    continue
+                cache.set(image_file,image_hash)
+
+            hashes.append(image_hash)
+
+    return hashes
+
+
+class PostLedger():
+
+    """Record of everything that has been posted. Posts are identified by the hash of the image
+    contents, so a post is recognised wherever the file lives and whatever it is called. Entries
+    imported from the old CSV ledger have no hash and are matched on file name instead.
+    Membership tests use in-memory sets; each new entry is committed as it is added"""
+
+    def __init__(self,dbfile=config.POST_LEDGER,legacy_csv=config.PREV_POSTS,\
+        hash_cache=config.CONTENT_HASH_CACHE) -> None:
+
+        self.dbfile = dbfile
+        self.hash_cache = hash_cache
+        self.conn = sqlite3.connect(dbfile,timeout=30)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS posted (id INTEGER PRIMARY KEY, content_hash TEXT UNIQUE, '
+            'filename TEXT, name TEXT, post_date TEXT, cleaned INTEGER DEFAULT 0, phash TEXT)')
+
+        #Ledgers written before perceptual hashes were recorded
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(posted)')]
+        if 'phash' not in columns:
+            with self.conn:
+                self.conn.execute('ALTER TABLE posted ADD COLUMN phash TEXT')
+
+        if self.conn.execute('SELECT COUNT(*) FROM posted').fetchone()[0] == 0:
+            self._import_legacy(legacy_csv)
+
+        self.hashes = set()
+        self.names = set()
+        for content_hash, name in self.conn.execute('SELECT content_hash,name FROM posted'):
+            if content_hash is None:
+                self.names.add(name)
+            else:
+                self.hashes.add(content_hash)
+
+    def _import_legacy(self,legacy_csv) -> None:
+
+        if not os.path.isfile(legacy_csv) or os.path.getsize(legacy_csv) == 0:
+            return
+
+        legacy = pd.read_csv(legacy_csv,names=['filename','post_date'])
+
+        with self.conn:
+            self.conn.executemany('INSERT INTO posted (filename,name,post_date) VALUES (?,?,?)',\
+                [(filename,os.path.basename(filename),str(post_date)) \
+                for filename, post_date in zip(legacy['filename'],legacy['post_date'])])
+
+    def close(self) -> None:
+
+        self.conn.close()
+
+    def posted_mask(self,image_files) -> np.ndarray:
+
+        """True for each image that has already been posted, or that duplicates an earlier
+        image in image_files"""
+
+        image_files = list(image_files)
+        mask = np.zeros(len(image_files),dtype=bool)
+        seen = set()
+
+        for i, (image_file, image_hash) in enumerate(zip(image_files,content_hashes(image_files,self.hash_cache))):
+            posted_name = os.path.basename(image_file) in self.names
+            #unreadable images have no hash, so are only matched by name (the size QC rejects them later)
+            if image_hash is None:
+                mask[i] = posted_name
+            else:
+                mask[i] = posted_name or image_hash in self.hashes or image_hash in seen
+                seen.add(image_hash)
+
+        return mask
+
+    def add(self,image_file,post_date=None) -> None:
+
+        """Record that image_file has been posted. Must be called while the file still exists"""
+
+        image_hash = content_hashes([image_file],self.hash_cache)[0]
+        phash = iu.dhash(image_file)
+        if post_date is None:
+            post_date = datetime.now()
+
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO posted (content_hash,filename,name,post_date,phash) VALUES (?,?,?,?,?)',\
+                (image_hash,image_file,os.path.basename(image_file),str(post_date),None if phash is None else f'{phash:016x}'))
+
+        if image_hash is None:
+            self.names.add(os.path.basename(image_file))
+        else:
+            self.hashes.add(image_hash)
+
+    def phashes(self) -> list:
+
+        """Perceptual hashes (see imageutils.dhash) of the posted images that have one"""
+
+        return [int(phash,16) for (phash,) in self.conn.execute('SELECT phash FROM posted WHERE phash IS NOT NULL')]
+
+    def uncleaned(self) -> list:
+
+        """(id, filename) of entries that cleanup has not yet dealt with"""
+
+        return self.conn.execute('SELECT id,filename FROM posted WHERE cleaned=0').fetchall()
+
+    def mark_cleaned(self,ids) -> None:
+
+        with self.conn:
+            self.conn.executemany('UPDATE posted SET cleaned=1 WHERE id=?',[(i,) for i in ids])
+
+
+class PostQueue():
+
+    """Posts chosen by ChoosePost.schedule, waiting to be posted in order. Scheduling a new batch
+    replaces whatever is left of the last one"""
+
+    def __init__(self,dbfile=config.POST_QUEUE) -> None:
+
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile,timeout=30)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS queue (position INTEGER PRIMARY KEY, image TEXT, '
+            'caption TEXT, scheduled TEXT, repo_version TEXT)')
+
+        #Queues written before the repo version was recorded
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(queue)')]
+        if 'repo_version' not in columns:
+            with self.conn:
+                self.conn.execute('ALTER TABLE queue ADD COLUMN repo_version TEXT')
+
+    def close(self) -> None:
+
+        self.conn.close()
+
+    def __len__(self) -> int:
+
+        return self.conn.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+
+    def replace(self,posts,repo_version=None) -> None:
+
+        """Replace the queue with posts, a list of dicts with Image and Caption entries, chosen
+        from repo_version of the post database"""
+
+        scheduled = str(datetime.now())
+
+        with self.conn:
+            self.conn.execute('DELETE FROM queue')
+            self.conn.executemany('INSERT INTO queue (image,caption,scheduled,repo_version) VALUES (?,?,?,?)',\
+                [(post['Image'],post['Caption'],scheduled,repo_version) for post in posts])
+
+    def scheduled(self) -> datetime:
+
+        """When the queued posts were scheduled (None if the queue is empty)"""
+
+        scheduled = self.conn.execute('SELECT MIN(scheduled) FROM queue').fetchone()[0]
+
+        return None if scheduled is None else pd.Timestamp(scheduled).to_pydatetime()
+
+    def repo_version(self) -> str:
+
+        """Version of the post database the queued posts were chosen from"""
+
+        row = self.conn.execute('SELECT repo_version FROM queue ORDER BY position LIMIT 1').fetchone()
+
+        return None if row is None else row[0]
+
+    def pop(self) -> dict:
+
+        """Remove and return the next post, skipping any whose image has been removed since it was
+        scheduled. None if the queue is empty"""
+
+        while True:
+
+            with self.conn:
+                row = self.conn.execute('SELECT position,image,caption FROM queue ORDER BY position LIMIT 1').fetchone()
+                if row is None:
+                    return None
+                self.conn.execute('DELETE FROM queue WHERE position=?',(row[0],))
+
+            if os.path.isfile(row[1]):
+                return {'Image':row[1],'Caption':row[2]}
@@ -7,45 +7,68 @@ import ProfileManip as pm
 import preprocessing as pp
 from config import config
 
-#download the profiles
-profiles_pipe = pm.ExtractParkStats()
-
-#metadata generation
-metadata_gen = dd.PackMetadata()
-
 #preprecessing
 #add any content classification and caption generation stages here 
 
-if config.USE_CLASSIFIER == True: 
-
-	process_pipe = Pipeline(
-
-		[
-		('feature_generation',
-			pp.FeatureGenerator()),
-		('caption_construction',
-			pp.CaptionConstructor()),
-		('image_classification',
-		    pp.ContentDetermination()),
-		('content_classification',
-			pp.CaptionTopicModelling()),
-		('image_choice',
-			pp.ChoosePost())
-		]
-	)
+def build_process_pipe() -> Pipeline:
+
+	"""Construct the processing pipeline. Building it loads the caption models, caption bank and tag
+	list, so long running processes should build it once and reuse it"""
+
+	if config.USE_CLASSIFIER == True: 
+
+		return Pipeline(
+
+			[
+			('near_duplicate_filter',
+				pp.NearDuplicateFilter()),
+			('feature_generation',
+				pp.FeatureGenerator()),
+			('caption_construction',
+				pp.CaptionConstructor()),
+			('image_classification',
+			    pp.ContentDetermination()),
+			('content_classification',
+				pp.CaptionTopicModelling()),
+			('image_choice',
+				pp.ChoosePost())
+			]
+		)
 	
-else:
-
-	process_pipe = Pipeline(
-
-		[
-		('feature_generation',
-			pp.FeatureGenerator()),
-		('caption_construction',
-			pp.CaptionConstructor()),
-		('content_classification',
-			pp.CaptionTopicModelling()),
-		('image_choice',
-			pp.ChoosePost())
-		]
-	)
+	else:
+
+		return Pipeline(
+
+			[
+			('near_duplicate_filter',
+				pp.NearDuplicateFilter()),
+			('feature_generation',
+				pp.FeatureGenerator()),
+			('caption_construction',
+				pp.CaptionConstructor()),
+			('content_classification',
+				pp.CaptionTopicModelling()),
+			('image_choice',
+				pp.ChoosePost())
+			]
+		)
+
+#The stages below are built the first time they are used, rather than on import, so that
+#entry points which never use them don't pay for loading models and caption banks
+_BUILDERS = {
+	#download the profiles
+	'profiles_pipe':pm.ExtractParkStats,
+	#metadata generation
+	'metadata_gen':dd.PackMetadata,
+	#preprocessing
+	'process_pipe':build_process_pipe
+}
+
+def __getattr__(name):
+
+	if name not in _BUILDERS:
+		raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+	globals()[name] = _BUILDERS[name]()
+
+	return globals()[name]
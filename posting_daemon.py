@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Long running alternative to run_posting.posting_wrapper. The processing pipeline (models, caption
+#bank and tag list) and the upload session are set up once and kept between posting cycles.
+#Send SIGHUP to reload them, or just edit the caption, tag or model files
+
+import argparse
+import os
+import signal
+import time
+from contextlib import ExitStack
+from config import config
+import pipeline
+import instrumentation
+import run_posting
+
+class PostingDaemon():
+
+    """Keep everything needed for a posting cycle in memory between cycles"""
+
+    WATCHED_FILES = [config.CAPTIONS,config.TAGS,config.CV_MODEL,config.LDA_MODEL]
+
+    def __init__(self,post_online=True,username=config.INSTA_UNAME,password=config.INSTA_PASS) -> None:
+
+        self.post_online = post_online
+        self.username = username
+        self.password = password
+        self.reload_requested = False
+        self.timings = []
+        self.uploads = ExitStack()
+        self.cli = None
+
+        signal.signal(signal.SIGHUP,self._request_reload)
+
+        self.reload()
+
+    def _request_reload(self,signum,frame) -> None:
+
+        print('Reload requested')
+        self.reload_requested = True
+
+    def _file_stamps(self) -> dict:
+
+        return {path:os.stat(path).st_mtime for path in self.WATCHED_FILES if os.path.exists(path)}
+
+    def reload(self) -> None:
+
+        """(Re)build the pipeline and open a fresh upload session"""
+
+        t0 = time.time()
+
+        self.process_pipe = pipeline.build_process_pipe()
+        self.stamps = self._file_stamps()
+
+        self.uploads.close()
+        if self.post_online:
+            from instapy_cli import client
+            self.cli = self.uploads.enter_context(client(self.username,self.password,write_cookie_file=False))
+
+        self.reload_requested = False
+        self.cold = True
+
+        print(f'Loaded pipeline and upload session in {time.time()-t0:.2f} seconds')
+
+    def cycle(self) -> dict:
+
+        """Choose and publish one post. Returns the timings of the cycle"""
+
+        if self.reload_requested or self._file_stamps() != self.stamps:
+            self.reload()
+
+        with instrumentation.cycle('posting'):
+
+            t0 = time.time()
+            post = run_posting.next_post(self.process_pipe)
+            t1 = time.time()
+
+            if post['Image'] != 'no_image':
+                with instrumentation.stage('upload'):
+                    run_posting.generate_post(post,post_online=self.post_online,cli=self.cli)
+            t2 = time.time()
+
+        timing = {'cycle':len(self.timings)+1,'state':'cold' if self.cold else 'warm',\
+            'choose_seconds':t1-t0,'post_seconds':t2-t1,'image':post['Image']}
+        self.timings.append(timing)
+        self.cold = False
+
+        print(f"Cycle {timing['cycle']} ({timing['state']}): chose a post in {timing['choose_seconds']:.2f} seconds, "
+            f"posted in {timing['post_seconds']:.2f} seconds")
+
+        return timing
+
+    def run(self,cycles=None) -> None:
+
+        """Post every config.POST_FREQ hours, for a given number of cycles or forever"""
+
+        try:
+            while cycles is None or len(self.timings) < cycles:
+                timing = self.cycle()
+                if timing['image'] == 'no_image':
+                    print('Image inventory empty. Waiting for a new download cycle to try again')
+                if cycles is None or len(self.timings) < cycles:
+                    time.sleep(3600*config.POST_FREQ)
+        finally:
+            self.uploads.close()
+            self.summary()
+
+    def summary(self) -> None:
+
+        """Print the mean cycle latency when cold (first cycle after a load) and warm"""
+
+        for state in ['cold','warm']:
+            times = [timing['choose_seconds'] for timing in self.timings if timing['state'] == state]
+            if times:
+                print(f'{state}: {len(times)} cycles, mean time to choose a post {sum(times)/len(times):.2f} seconds')
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cycles',type=int,default=None,help='stop after this many cycles')
+    parser.add_argument('--offline',action='store_true',help='choose posts without uploading them')
+    args = parser.parse_args()
+
+    PostingDaemon(post_online=not args.offline).run(cycles=args.cycles)
+
+
+if __name__ == "__main__":
+
+    main()
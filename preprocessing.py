@@ -4,34 +4,110 @@
 import numpy as np
 import pandas as pd
 import re
+import os
 from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.utils import shuffle
-import matplotlib.image as mpimg
-import matplotlib.pyplot as plt
+from sklearn.utils import check_random_state
 from config import config
-import torch 
-from torchvision import transforms
+from filecache import FileCache, file_checksum
+import imageutils as iu
+from hammingindex import HammingIndex
+from ledger import PostLedger
 from PIL import Image
 from datetime import datetime
 import pickle
 import time
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class NearDuplicateFilter(BaseEstimator, TransformerMixin):
+
+    """Remove posts whose image is a near duplicate of another post in the inventory, or of something
+    we have already posted. Parks often repost the same photo (or a crop of it) under a different
+    file name. Images are compared by perceptual hash, which is computed once per image and cached"""
+
+    def __init__(self,cache=config.PHASH_CACHE,max_distance=config.PHASH_MAX_DISTANCE,\
+        ledger=config.POST_LEDGER,hash_cache=config.CONTENT_HASH_CACHE) -> None:
+
+        self.cache = cache
+        self.max_distance = max_distance
+        self.ledger = ledger
+        self.hash_cache = hash_cache
+
+    def fit(self, X: pd.DataFrame, y: pd.Series = None) -> 'NearDuplicateFilter':
+
+        """Fit statement to accomodate the sklearn pipeline."""
+
+        return self
+
+    def _perceptual_hashes(self, image_files) -> list:
+
+        hashes = []
+
+        with FileCache(self.cache,'phash') as cache:
+
+            cache.evict_missing()
+
+            for image_file in image_files:
+                if image_file in cache:
+                    hashes.append(cache.get(image_file))
+                else:
+                    phash = iu.dhash(image_file)
+                    if phash is not None:
+                        cache.set(image_file,phash)
+                    hashes.append(phash)
+
+        return hashes
+
+    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
+
+        X = X.copy()
+
+        hashes = self._perceptual_hashes(X['Flocation'])
+
+        index = HammingIndex(self.max_distance)
+        ledger = PostLedger(self.ledger,hash_cache=self.hash_cache)
+        for phash in ledger.phashes():
+            index.add(phash)
+        ledger.close()
+
+        #Of each group of near duplicates, keep the one with the most engagement
+        keep = np.zeros(len(X),dtype=bool)
+        for i in np.argsort(-X['nlikes_per_follower'].values,kind='stable'):
+            if hashes[i] is None:
+                #unreadable images are rejected by the size QC later on
+                keep[i] = True
+            elif not index.has_near(hashes[i]):
+                keep[i] = True
+                index.add(hashes[i])
+
+        print(f'Removed {len(X) - keep.sum()} near duplicate posts')
+        self.qc_drops = {'near_duplicate':int(len(X) - keep.sum())}
+
+        return X[keep].reset_index(drop=True)
+
 
 class FeatureGenerator(BaseEstimator, TransformerMixin):
 
     """Generate features used to rank posts"""
 
-    def __init__(self) -> None:
+    def __init__(self,size_cache=config.IMAGE_SIZE_CACHE,min_width=config.MIN_IMAGE_WIDTH,reference_time=None) -> None:
+
+        """reference_time is the time that post ages are measured from, the time of fitting if None"""
 
         #This hard coding is not ideal - come back and fix once the processing is
         #finalized
         self.variables = config.GENERATED_FEATURES
+        self.size_cache = size_cache
+        self.min_width = min_width
+        self.reference_time = reference_time
 
     def fit(self, X: pd.DataFrame, y: pd.Series = None
             ) -> 'FeatureGenerator':
 
         """Fit statement to accomodate the sklearn pipeline."""
 
-        self.now = datetime.now()
+        self.now = datetime.now() if self.reference_time is None else self.reference_time
 
         self.summary = X[self.variables].groupby('credits').mean().reset_index()
 
@@ -45,71 +121,66 @@ class FeatureGenerator(BaseEstimator, TransformerMixin):
 
         return self
 
-    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
+    def generate_rank_features(self, X: pd.DataFrame) -> pd.DataFrame:
 
-        """Apply the transforms to the dataframe."""
+        """Add the per-park normalised engagement features and the post rank.
+        Works on whole columns at once, so the cost is linear in the number of posts"""
 
-        X = X.copy()
+        X['postdate'] = pd.to_datetime(X['postdate'])
 
-        #We could do some NLP here to get sentiments scores on the captions, for example 
+        #days since each post was made, with a minimum of one day
+        ndays = (self.now - X['postdate']).dt.days.clip(lower=1).values
 
-        def __image_size_check(image_loc) -> float:
+        #per-park means from the fit stage, aligned with each row
+        park_means = self.summary.set_index('credits')
+        mean_likes = X['credits'].map(park_means['nlikes_per_follower']).values
+        mean_comments = X['credits'].map(park_means['ncomments_per_follower']).values
 
-            image = mpimg.imread(image_loc)
+        X['mean_nlikes_diff'] = (X['nlikes_per_follower'].values - mean_likes)/(mean_likes*ndays)
+        X['mean_ncomments_diff'] = (X['ncomments_per_follower'].values - mean_comments)/(mean_comments*ndays)
+        X['park_id'] = X['credits'].map(self.names_dir)
+        X['rank'] = X['mean_nlikes_diff']*config.LIKES_WEIGHT + X['mean_ncomments_diff']*config.COMMENT_WEIGHT
 
-            try:
-            	(h,w,n) = image.shape
-            except:
-            	return np.nan
-            if w < 800:
-                return np.nan
-            else:
-                return (h,w,n)
+        return X
 
-        def __difference_from_mean_likes_per_follower(row) -> float:
+    def _image_size_check(self, image_locs) -> list:
 
-            name = row['credits']
-            ndays = (self.now - row['postdate']).days
+        """Size QC of each image. Dimensions are read from the file headers and cached on disk,
+        so only new or modified images are opened"""
 
-            if ndays < 1:
-                ndays = 1
+        sizes = []
 
-            return (row['nlikes_per_follower'] - \
-                self.summary[self.summary['credits']==name]['nlikes_per_follower'].values[0])/(self.summary[self.summary['credits']==name]['nlikes_per_follower'].values[0]*ndays)
+        with FileCache(self.size_cache,'image_size') as cache:
 
-        def __difference_from_mean_comments_per_follower(row) -> float:
+            cache.evict_missing()
 
-            name = row['credits']
-            ndays = (self.now - row['postdate']).days
+            for image_loc in image_locs:
 
-            if ndays < 1:
-                ndays = 1
+                if image_loc in cache:
+                    shape = cache.get(image_loc)
+                else:
+                    shape = iu.image_dimensions(image_loc)
+                    if shape is not None:
+                        cache.set(image_loc,shape)
 
-            return (row['ncomments_per_follower'] - \
-                self.summary[self.summary['credits']==name]['ncomments_per_follower'].values[0])/(self.summary[self.summary['credits']==name]['ncomments_per_follower'].values[0]*ndays)
+                #Greyscale images and those that are too small are rejected
+                if shape is None or shape[2] < 2 or shape[1] < self.min_width:
+                    sizes.append(np.nan)
+                else:
+                    sizes.append(tuple(shape))
 
-        def __categorize_parks(parkid) -> int:
+        return sizes
 
-            return self.names_dir[parkid]
+    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
 
-        def __post_rank(row,likes_weight=config.LIKES_WEIGHT,comments_weight=config.COMMENT_WEIGHT) -> float:
+        """Apply the transforms to the dataframe."""
 
-            return row['mean_nlikes_diff']*likes_weight + row['mean_ncomments_diff']*comments_weight
-        
-        #def __previously_posted(floc):
-            
-        #    if floc in self.previous_posts:
-        #        return np.nan
-        #    else:
-        #        return 1
+        X = X.copy()
 
-        X['postdate'] = pd.to_datetime(X['postdate'])
-        X['mean_nlikes_diff'] = X.apply(lambda row: __difference_from_mean_likes_per_follower(row),axis=1)
-        X['mean_ncomments_diff'] = X.apply(lambda row: __difference_from_mean_comments_per_follower(row),axis=1)
-        X['park_id'] = X['credits'].apply(__categorize_parks)
-        X['rank'] = X.apply(lambda row: __post_rank(row),axis=1)
-        X['image_size'] = X['Flocation'].apply(__image_size_check)
-        
+        #We could do some NLP here to get sentiments scores on the captions, for example 
+
+        X = self.generate_rank_features(X)
+        X['image_size'] = self._image_size_check(X['Flocation'])
 
         return X
 
@@ -119,81 +190,99 @@ class CaptionConstructor(BaseEstimator,TransformerMixin):
 
     '''Construct captions and do QC'''
 
+    #whitespace separated words starting with # (hashtags) or @ (mentions)
+    TAG_REGEX = re.compile(r'(?<!\S)([#@]\S*)')
+    #punctuation at the end of a hashtag or mention
+    TRAILING_REGEX = re.compile(r'\W+$')
+    #everything up to the end of the first sentence
+    FIRST_SENTENCE_REGEX = re.compile(r'^([^.!]*)')
+    #characters removed from the quoted part of the original caption
+    QUOTE_REGEX = re.compile('[@$"]')
+
     def __init__(self) -> None:
 
         return None
 
     def fit(self, X: pd.DataFrame, y: pd.Series = None) -> 'CaptionConstructor':
 
-        #List of tags that we don't want to include
+        #List of tags that we don't want to include, and a single pattern matching any of them
         self.hashtagQClist = config.HASHTAG_QC
+        self.hashtagQCregex = re.compile('|'.join(re.escape(word) for word in self.hashtagQClist) or '(?!)')
         return self
 
-    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
+    @staticmethod
+    def _row_lists(rows, values, nrows) -> list:
 
-        print("Constructing captions")
-        t0 = time.time()
+        """Group values into one list per row, given the (sorted) row of each value. Rows with
+        no values get None"""
 
-        X = X.copy()
+        counts = np.bincount(rows,minlength=nrows)
+        ends = np.cumsum(counts)
+        values = list(values)
 
-        def __extract_hashtags(string):
+        return [values[end-count:end] if count else None for end, count in zip(ends.tolist(),counts.tolist())]
 
-            try:
-                hashtags = [re.sub(r"(\W+)$", "", j) for j in set([i for i in string.split() if i.startswith("#")])]
-            except:
-                return np.nan
-            if len(hashtags) == 0:
-                return np.nan
-            else:
-                return hashtags
-
-        def __extract_pcredits(row):
-            string = row['caption']
-
-            try:
-                pcredits = [re.sub(r"(\W+)$", "", j) for j in set([i for i in string.split() if i.startswith("@")])]
-                pcredits.append('@'+row['credits'])
-            except:
-                return np.nan
-
-            return pcredits
-
-        def __hashtagQC(hashtags):
-            
-            hashstring = ''.join(hashtags).lower()
-            for word in self.hashtagQClist:
-                if word in hashstring:
-                    return np.nan
-            return [e.lower() for e in hashtags if len(e) > 1]
-
-        def __generate_repost_caption(row):
-    
-            caption = row['caption']
-            date = row['postdate']
-            credit = row['credits']
-            a = re.split("[.!]+", caption)[0]
-            
-            if a[-1] == '?':
-                a[-1] == '!'
-            else:
-                a = a+'!'
+    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
 
-            a = re.sub('[@$""'']', '', a)
-            
-            post_date = f"{date.month:02d}-{date.day:02d}-{date.year}"
-                
-            comment = f'Here is a segment from the original post, by @{credit} on {post_date}: "{a}"'
-            return comment
+        print("Constructing captions")
+        t0 = time.time()
 
+        X = X.copy()
+        nrows = len(X)
+
+        captions = pd.Series(X['caption'].values,dtype=object)
+        credits = pd.Series(X['credits'].values,dtype=object)
+
+        #Pull every hashtag and mention out of the captions in one pass. Each is kept once per
+        #caption, in order of first appearance, then has any trailing punctuation removed
+        found = [self.TAG_REGEX.findall(caption) if isinstance(caption,str) else [] for caption in captions]
+        tags = pd.DataFrame({'row':np.repeat(np.arange(nrows),[len(caption_tags) for caption_tags in found]),\
+            'raw':pd.Series([tag for caption_tags in found for tag in caption_tags],dtype=object)})
+        tags = tags.drop_duplicates(['row','raw'])
+        tags['tag'] = tags['raw'].str.replace(self.TRAILING_REGEX,'',regex=True)
+        is_hashtag = tags['raw'].str.startswith('#').values
+
+        hashtags = tags[is_hashtag]
+        mentions = tags[~is_hashtag]
+
+        #Captions with a blacklisted word in any of their hashtags fail the QC. The remaining
+        #hashtags are lower cased and any that are empty or a single character are dropped
+        lower = hashtags['tag'].str.lower()
+        rejected = np.zeros(nrows,dtype=bool)
+        rejected[hashtags['row'].values[lower.str.contains(self.hashtagQCregex,regex=True).values]] = True
+
+        keep = (lower.str.len() > 1).values
+        kept_hashtags = self._row_lists(hashtags['row'].values[keep],lower.values[keep],nrows)
+        has_hashtags = np.zeros(nrows,dtype=bool)
+        has_hashtags[hashtags['row'].values] = True
+
+        #captions without hashtags, or that fail the QC, get nan and are removed below
+        X['hashtags'] = [(hashtag_list or []) if has and not reject else np.nan \
+            for hashtag_list, has, reject in zip(kept_hashtags,has_hashtags,rejected)]
+
+        #people credited in the caption, plus the park itself
+        X['pcredits'] = [(mention_list or [])+['@'+credit] if isinstance(credit,str) and isinstance(caption,str) else np.nan \
+            for mention_list, credit, caption in zip(self._row_lists(mentions['row'].values,mentions['tag'].values,nrows),credits,captions)]
 
-        X['hashtags'] = X['caption'].apply(__extract_hashtags)
-        X['pcredits'] = X.apply(lambda row: __extract_pcredits(row),axis=1)
         X['postdate'] = pd.to_datetime(X['postdate'])
 
-        X.dropna(inplace=True)
+        #The first sentence of the original caption, ending in ! unless it is a question
+        first_sentence = captions.str.extract(self.FIRST_SENTENCE_REGEX,expand=False)
+        first_sentence = first_sentence.where(first_sentence.str.endswith('?',na=False),first_sentence+'!')
+        first_sentence = first_sentence.str.replace(self.QUOTE_REGEX,'',regex=True)
 
-        X['hashtags'] = X['hashtags'].apply(__hashtagQC)
-        X['repost_comment'] = X.apply(lambda row: __generate_repost_caption(row),axis=1)
+        #posts share a handful of dates, so only format each date once
+        days, day_index = np.unique(X['postdate'].dt.normalize().values,return_inverse=True)
+        post_dates = pd.Series(np.asarray(pd.DatetimeIndex(days).strftime('%m-%d-%Y'),dtype=object)[day_index.ravel()])
+        X['repost_comment'] = ('Here is a segment from the original post, by @'+credits+' on '+post_dates+': "'+first_sentence+'"').values
+
+        #what the dropna below removes, attributing each row to the first QC it fails
+        missing = X.isnull().any(axis=1).values
+        bad_size = X['image_size'].isnull().values if 'image_size' in X else np.zeros(nrows,dtype=bool)
+        no_hashtags = ~has_hashtags & ~bad_size
+        blacklisted = rejected & ~bad_size
+        self.qc_drops = {'image_size':int(bad_size.sum()),'no_hashtags':int(no_hashtags.sum()),\
+            'hashtag_blacklist':int(blacklisted.sum()),'missing_metadata':int((missing & ~bad_size & ~no_hashtags & ~blacklisted).sum())}
 
         X.dropna(inplace=True)
 
@@ -207,10 +296,12 @@ class CaptionConstructor(BaseEstimator,TransformerMixin):
 
 class CaptionTopicModelling(BaseEstimator,TransformerMixin):
 
-    def __init__(self) -> None:
+    def __init__(self,cache=config.CLASSIFICATION_CACHE) -> None:
 
+        self.cache = cache
         self.LDA_model = pickle.load(open(config.LDA_MODEL,'rb'))
         self.CV_model = pickle.load(open(config.CV_MODEL,'rb'))
+        self.model_identity = file_checksum(config.CV_MODEL,config.LDA_MODEL)
         return None
 
     def fit(self, X: pd.DataFrame, y: pd.Series = None) -> 'CaptionTopicModelling':
@@ -220,7 +311,8 @@ class CaptionTopicModelling(BaseEstimator,TransformerMixin):
     def transform(self, X: pd.DataFrame) -> pd.DataFrame:
 
         '''
-        Apply the LDA to classify the captions into one of three topic classes
+        Apply the LDA to classify the captions into one of three topic classes. Results are
+        cached per post, so only new or edited captions are passed through the models
         '''
 
         X = X.copy()
@@ -228,40 +320,161 @@ class CaptionTopicModelling(BaseEstimator,TransformerMixin):
         print("Determining caption topics")
         t0 = time.time()
 
-        dtm = self.CV_model.transform(X['caption'])
-        topic_probs = self.LDA_model.transform(dtm)
+        image_files = list(X['Flocation'])
+        captions = list(X['caption'])
+        caption_hashes = [hashlib.sha1(caption.encode('utf-8')).hexdigest() for caption in captions]
+        caption_classes = [None]*len(captions)
+
+        with FileCache(self.cache,'caption_class',identity=self.model_identity) as cache:
+
+            cache.evict_missing()
 
-        X['caption_class'] = np.argmax(topic_probs,axis=1)
+            for i, image_file in enumerate(image_files):
+                cached = cache.get(image_file)
+                if cached is not None and cached[0] == caption_hashes[i]:
+                    caption_classes[i] = cached[1]
+
+            new_posts = [i for i, caption_class in enumerate(caption_classes) if caption_class is None]
+
+            if new_posts:
+
+                dtm = self.CV_model.transform([captions[i] for i in new_posts])
+                topic_probs = self.LDA_model.transform(dtm)
+
+                for i, caption_class in zip(new_posts,np.argmax(topic_probs,axis=1)):
+                    caption_classes[i] = int(caption_class)
+                    cache.set(image_files[i],[caption_hashes[i],int(caption_class)])
+
+        X['caption_class'] = caption_classes
 
         t1 = time.time()
-        print(f'Done in {t1-t0} seconds')
+        print(f'Done in {t1-t0} seconds ({len(new_posts)} new captions)')
 
         return X 
 
 
+def load_pickled_model(model_file):
+
+    """torch.load a whole pickled model onto the CPU. Since torch 2.6 torch.load only unpickles
+    plain tensors unless weights_only=False is given, which older versions do not accept"""
+
+    import inspect
+    import torch
+
+    if 'weights_only' in inspect.signature(torch.load).parameters:
+        return torch.load(model_file,map_location='cpu',weights_only=False)
+
+    return torch.load(model_file,map_location='cpu')
+
+
 class ContentDetermination(BaseEstimator,TransformerMixin):
 
     '''Load a pretrained CNN (based in vgg16) and classify the images
     into people, animals, landscapes and buildings (or whatever labels have
-    been provided)'''
+    been provided). torch is only imported once this stage is used'''
 
-    def __init__(self) -> None:
+    #model input size, and the smallest size (as a multiple of it) that JPEGs are decoded at for each decode setting
+    INPUT_SIZE = 224
+    DECODE_SCALES = {'full':None,'quality':2,'speed':1}
 
-        return None
+    def __init__(self,classifier=config.CLASSIFIERPATH,batch_size=config.CLASSIFIER_BATCH_SIZE,\
+        num_workers=config.CLASSIFIER_WORKERS,num_threads=config.TORCH_THREADS,\
+        cache=config.CLASSIFICATION_CACHE,decode=config.CLASSIFIER_DECODE) -> None:
+
+        self.classifier = classifier
+        self.cache = cache
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.num_threads = num_threads
+        self.decode = decode
 
     def fit(self, X: pd.DataFrame, y: pd.Series = None) -> 'ContentDetermination':
 
-        self.mymodel = torch.load(config.CLASSIFIERPATH,map_location='cpu')
+        import torch
+        from torchvision import transforms
 
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+
+        #The pipeline is fitted every cycle, but the model only needs loading again if the file has changed
+        model_stamp = os.stat(self.classifier).st_mtime
+        if getattr(self,'model_stamp',None) != model_stamp:
+            if self.classifier.endswith('.pt'):
+                #TorchScript export made by export_classifier.py
+                self.mymodel = torch.jit.load(self.classifier,map_location='cpu')
+            else:
+                self.mymodel = load_pickled_model(self.classifier)
+            self.mymodel.eval()
+            self.model_checksum = file_checksum(self.classifier)
+            self.model_stamp = model_stamp
 
-        self.transform_validation = transforms.Compose([transforms.Resize((224,224)),
+        if self.decode not in self.DECODE_SCALES:
+            raise ValueError(f"decode must be one of {', '.join(self.DECODE_SCALES)}, not {self.decode!r}")
+
+        self.transform_validation = transforms.Compose([transforms.Resize((self.INPUT_SIZE,self.INPUT_SIZE)),
                                 transforms.ToTensor(),
                                 transforms.Normalize((0.5,),(0.5,))])
 
         self.classes = config.IMAGE_CLASSES
 
+        #cached classifications are only valid for this model, set of labels and way of decoding images
+        self.model_identity = self.model_checksum+':'+','.join(self.classes)
+        if self.decode != 'full':
+            self.model_identity += ':'+self.decode
+
         return self
 
+    def _decode_image(self, image_file) -> Image.Image:
+
+        with Image.open(image_file) as img:
+            scale = self.DECODE_SCALES[self.decode]
+            if scale:
+                #JPEGs are scaled down by 1/2, 1/4 or 1/8 while decoding, as far as possible without
+                #going below this size. Does nothing for other formats
+                img.draft('RGB',(self.INPUT_SIZE*scale,self.INPUT_SIZE*scale))
+            return img.convert('RGB')
+
+    def _load_image(self, image_file) -> 'torch.Tensor':
+
+        return self.transform_validation(self._decode_image(image_file))
+
+    def _image_batches(self, image_files, prefetch=2):
+
+        """Yield stacked batches of preprocessed images. Decoding runs on a thread pool
+        and keeps up to prefetch batches queued ahead of the model"""
+
+        import torch
+
+        image_files = list(image_files)
+        batches = [image_files[i:i+self.batch_size] for i in range(0,len(image_files),self.batch_size)]
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+
+            queued = deque()
+            for batch in batches:
+                queued.append([pool.submit(self._load_image,image_file) for image_file in batch])
+                if len(queued) > prefetch:
+                    yield torch.stack([future.result() for future in queued.popleft()])
+
+            while queued:
+                yield torch.stack([future.result() for future in queued.popleft()])
+
+    def predict_classes(self, image_files) -> list:
+
+        """Return the predicted class name of each image"""
+
+        import torch
+
+        predictions = []
+
+        with torch.no_grad():
+            for batch in self._image_batches(image_files):
+                output = self.mymodel(batch)
+                _, preds = torch.max(output,1)
+                predictions.extend(self.classes[pred] for pred in preds.tolist())
+
+        return predictions
+
     def transform(self, X: pd.DataFrame) -> pd.DataFrame:
 
         print("Classifying images")
@@ -269,30 +482,29 @@ class ContentDetermination(BaseEstimator,TransformerMixin):
 
         X = X.copy()
 
-        classifications = []
-
-        for image_file in X['Flocation']:
-
-            img = Image.open(image_file)
-            img = self.transform_validation(img)
-            image_for_model = img.unsqueeze(0)
-            output = self.mymodel(image_for_model)
-            _, preds = torch.max(output,1)
-            
-            classification = self.classes[preds.item()]
-            
-            #We don't really want images of things that are not animals or landscapes so remove them (replace with nan, which will be removed later)
-            
-            if classification == 'other':
-                classifications.append(np.nan)
-            else:
-                classifications.append(classification)
+        image_files = list(X['Flocation'])
+
+        #Only run the model on images that have not been classified before
+        with FileCache(self.cache,'image_class',identity=self.model_identity) as cache:
+
+            cache.evict_missing()
+
+            new_images = [image_file for image_file in image_files if image_file not in cache]
+            for image_file, classification in zip(new_images,self.predict_classes(new_images)):
+                cache.set(image_file,classification)
+
+            classifications = [cache.get(image_file) for image_file in image_files]
+
+        #We don't really want images of things that are not animals or landscapes so remove them (replace with nan, which will be removed later)
+        classifications = [np.nan if classification == 'other' else classification \
+            for classification in classifications]
 
         X['Image_class'] = classifications
+        self.qc_drops = {'image_class':int(X['Image_class'].isnull().sum())}
         X.dropna(inplace=True)
         X.reset_index(inplace=True)
         t1 = time.time()
-        print(f'Done in {t1-t0} seconds')
+        print(f'Done in {t1-t0} seconds ({len(new_images)} new images)')
 
         return X
 
@@ -300,7 +512,21 @@ class ChoosePost(BaseEstimator, TransformerMixin):
 
     """Chose an image and caption to post"""
 
-    def __init__(self,captions=config.CAPTIONS,tags=config.TAGS) -> None:
+    #caption bank used for each image class, anything else gets the general captions
+    CAPTION_BANKS = {'wildlife':'animals','landscapes':'landscapes'}
+
+    #number of tags from the tag list added to each caption
+    NTAGS = 20
+
+    def __init__(self,captions=config.CAPTIONS,tags=config.TAGS,random_state=None) -> None:
+
+        """random_state seeds the choice of post, caption and tags (see sklearn's check_random_state),
+        so that a cycle can be reproduced. The generator is reset from it each time the stage is fitted"""
+
+        self.captions = captions
+        self.tags = tags
+        self.random_state = random_state
+        self.rng = check_random_state(random_state)
 
         #captions_land = captions['landscapes']
         #captions_ani = captions['animals']
@@ -324,11 +550,31 @@ class ChoosePost(BaseEstimator, TransformerMixin):
 
         self.loaded_tags = pd.read_csv(tags_loc,names=['tag'])
 
+        #precompile the caption bank into arrays of ready formatted captions keyed by (imageclass, quoteclass)
+        #and the tag list into an array, so that generating a caption needs no pandas filtering
+        quotes = self.loaded_comments['quote'].map(self._quote_caption)
+        self.caption_index = {(imageclass,int(quoteclass)):group.values.astype(object) for (imageclass,quoteclass), group in \
+            quotes.groupby([self.loaded_comments['imageclass'],self.loaded_comments['quoteclass']])}
+        self.tag_bank = self.loaded_tags['tag'].values.astype(object)
+
+    @staticmethod
+    def _quote_caption(quote) -> str:
+
+        """Put the quote part of 'quote - author' captions in quotation marks"""
+
+        if ' - ' in quote:
+            caption_parts = quote.split(' - ')
+            quote = '"'+caption_parts[0]+'"'+' - '+caption_parts[1]
+
+        return quote
+
 
     def fit(self, X: pd.DataFrame, y: pd.Series = None
             ) -> 'ChoosePost':
         """Fit statement to accomodate the sklearn pipeline."""
 
+        self.rng = check_random_state(self.random_state)
+
         return self
 
     def transform(self, X: pd.DataFrame,debug=False) -> dict:
@@ -360,22 +606,18 @@ class ChoosePost(BaseEstimator, TransformerMixin):
                     print('---------------------')
                     print(X)
 
-                    pp = np.random.choice(np.arange(len(X)),size=1,replace=True,p=self.p)[0]
-
-                    chosen_image_caption = X.iloc[pp]['repost_comment']
-                    chosen_image_hashtags = X.iloc[pp]['hashtags']
-                    chosen_image_pcredits = X.iloc[pp]['pcredits']
-                    chosen_caption_class = X.iloc[pp]['caption_class']
+                    pp = self.rng.choice(np.arange(len(X)),size=1,replace=True,p=self.p)[0]
+                    chosen = X.iloc[pp]
 
                     if config.USE_CLASSIFIER == True: 
-                        chosen_image_class = X.iloc[pp]['Image_class']
+                        chosen_image_class = chosen['Image_class']
                     else:
                         chosen_image_class = 'general'
 
-                    repost_comment = self._generate_caption_basic(chosen_image_caption,list(chosen_image_pcredits),\
-                        list(chosen_image_hashtags),chosen_image_class,chosen_caption_class)
+                    repost_comment = self._generate_caption_basic(chosen['repost_comment'],list(chosen['pcredits']),\
+                        list(chosen['hashtags']),chosen_image_class,chosen['caption_class'])
 
-                    chosen_image = X.iloc[pp]['Flocation']
+                    chosen_image = chosen['Flocation']
                     error = 0
 
                 #except:
@@ -391,6 +633,9 @@ class ChoosePost(BaseEstimator, TransformerMixin):
 
                     print(repost_comment)
 
+                    import matplotlib.image as mpimg
+                    import matplotlib.pyplot as plt
+
                     image = mpimg.imread(chosen_image)
                     plt.imshow(image)
                     plt.axis('off')
@@ -398,55 +643,85 @@ class ChoosePost(BaseEstimator, TransformerMixin):
 
             return {'Image':chosen_image,'Caption':repost_comment}
 
+    def schedule(self,X: pd.DataFrame,k,max_per_park=config.MAX_QUEUED_PER_PARK) -> list:
+
+        """Choose up to k different posts in one go, each with probability weighted by rank as in
+        transform, and no more than max_per_park from any one park. Returns a list of dicts like
+        the one returned by transform, in the order they should be posted"""
+
+        if X.shape[0] < 1:
+            return []
+
+        ranks = np.nan_to_num(X['rank'].values)
+        ranks = ranks - min(ranks)
+        if not ranks.any():
+            ranks = np.ones(len(ranks))
+
+        #weighted sampling without replacement in a single draw: order the posts by log(u)/rank
+        #for uniform u (Efraimidis & Spirakis) and take them from the top
+        with np.errstate(divide='ignore'):
+            keys = np.log(self.rng.random_sample(len(ranks)))/ranks
+        order = np.argsort(-keys,kind='stable')
+        order = order[ranks[order] > 0]
+
+        #skip posts from parks that already have max_per_park earlier in the order
+        parks = pd.Series(X['credits'].values[order])
+        order = order[(parks.groupby(parks).cumcount() < max_per_park).values][:k]
+
+        if config.USE_CLASSIFIER == True:
+            image_classes = X['Image_class'].values[order]
+        else:
+            image_classes = ['general']*len(order)
+
+        captions = self.generate_captions(X['repost_comment'].values[order],[list(credits) for credits in X['pcredits'].values[order]],\
+            [list(hashtags) for hashtags in X['hashtags'].values[order]],image_classes,X['caption_class'].values[order])
+
+        return [{'Image':image,'Caption':caption} for image, caption in zip(X['Flocation'].values[order],captions)]
+
 
     def _generate_caption_basic(self,base_caption,credits,hashtags,image_class='general',caption_class=0):
         
         """Run this to generate a caption specific to the image that has been chosen"""
 
-        # if image_class == 'animals':
-        #     loaded_comments = self.loaded_comments[self.loaded_comments['imageclass']=='animals']
-        # elif image_class == 'landscapes':
-        #     loaded_comments = self.loaded_comments[self.loaded_comments['imageclass']=='landscapes']
-        # elif image_class == 'people':
-        #     loaded_comments = self.loaded_comments[self.loaded_comments['imageclass']=='people']
-        # elif image_class == 'buildings':
-        #     loaded_comments = self.loaded_comments[self.loaded_comments['imageclass']=='buildings']
-        # else:
-        #     loaded_comments = self.loaded_comments[self.loaded_comments['imageclass']=='general']
-
-        if image_class == 'wildlife':
-            loaded_comments = self.loaded_comments[self.loaded_comments['imageclass']=='animals']
-        elif image_class == 'landscapes':
-            loaded_comments = self.loaded_comments[self.loaded_comments['imageclass']=='landscapes']
-        else:
-            loaded_comments = self.loaded_comments[self.loaded_comments['imageclass']=='general']
-        
-        comments_list = list(loaded_comments[loaded_comments['quoteclass']==caption_class]['quote'])
-        tags_list = list(self.loaded_tags['tag'])
-        
-        chosen_caption = np.random.choice(comments_list,size=1)[0]
-        chosen_tags = list(np.random.choice(tags_list,size=20,replace=False))
+        return self.generate_captions([base_caption],[credits],[hashtags],[image_class],[caption_class])[0]
 
+    def generate_captions(self,base_captions,credits,hashtags,image_classes,caption_classes) -> list:
 
-        if ' - ' in chosen_caption:
-            caption_parts = chosen_caption.split(' - ')
-            chosen_caption = '"'+caption_parts[0]+'"'+' - '+caption_parts[1]
-        
-        for hashtag in hashtags:
-            if hashtag not in chosen_tags:
-                chosen_tags.append(hashtag)
-        
-        credits = ' '.join(list(set(credits)))
-        chosen_tags = ' '.join(chosen_tags)
+        """Generate captions for many images at once (e.g. to preview or compare them). Each argument
+        has one entry per image, as for _generate_caption_basic"""
+
+        n = len(base_captions)
+
+        #one random caption from the matching bank for each image
+        chosen_captions = np.empty(n,dtype=object)
+        banks = [(self.CAPTION_BANKS.get(image_class,'general'),int(caption_class)) \
+            for image_class, caption_class in zip(image_classes,caption_classes)]
+        for bank in set(banks):
+            rows = np.array([key == bank for key in banks])
+            options = self.caption_index[bank]
+            chosen_captions[rows] = options[self.rng.randint(len(options),size=rows.sum())]
+
+        #NTAGS different tags for each image: the first NTAGS of a random permutation of the tag list
+        tag_choices = np.argsort(self.rng.random_sample((n,len(self.tag_bank))),axis=1)[:,:self.NTAGS]
+        chosen_tags = self.tag_bank[tag_choices]
 
         tl1 = config.TAG_LINE_1
         tl2 = config.TAG_LINE_2
         tl3 = config.TAG_LINE_3
 
-        repost_caption = f'{chosen_caption}\n\n\n{base_caption}\n📸: {credits}\n\n{tl1}\n\n{tl2}\n\n{tl3}\n\n\n\n\n{chosen_tags}'
-        
-        return repost_caption
-    
+        repost_captions = []
 
+        for chosen_caption, base_caption, image_credits, image_hashtags, image_tags in \
+            zip(chosen_captions,base_captions,credits,hashtags,chosen_tags):
 
+            image_tags = list(image_tags)
+            for hashtag in image_hashtags:
+                if hashtag not in image_tags:
+                    image_tags.append(hashtag)
 
+            image_credits = ' '.join(dict.fromkeys(image_credits))
+            image_tags = ' '.join(image_tags)
+
+            repost_captions.append(f'{chosen_caption}\n\n\n{base_caption}\n📸: {image_credits}\n\n{tl1}\n\n{tl2}\n\n{tl3}\n\n\n\n\n{image_tags}')
+        
+        return repost_captions
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+#RMS 2019
+
+import threading
+import time
+
+class TokenBucket():
+
+    """Thread-safe token bucket. Allows bursts of up to capacity requests and an average of
+    rate requests per second. Shared between workers to keep the total request rate down"""
+
+    def __init__(self,rate,capacity=1) -> None:
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+
+        """Block until a token is available, then take it"""
+
+        while True:
+
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens)/self.rate
+
+            time.sleep(wait)
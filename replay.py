@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#RMS 2019
+
+#Record the inputs of a posting cycle, and replay it offline. A snapshot holds the post metadata
+#that went into the processing pipeline (with hard links to the images), a copy of the post ledger,
+#the random seed and reference time used, the identities of the models and the post(s) chosen.
+#Replaying re-runs the pipeline on the snapshot and checks that it chooses the same post(s) with
+#the same captions, printing the time taken by each stage
+#Snapshots are recorded by run_posting when config.RECORD_DIR is set. To replay them:
+#python replay.py SNAPSHOT_DIR [SNAPSHOT_DIR ...]
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+import pandas as pd
+from config import config
+from filecache import file_checksum
+import imageutils as iu
+import instrumentation
+
+#Settings that change what a cycle produces. They are stored with each snapshot and compared on replay
+RECORDED_SETTINGS = ['USE_CLASSIFIER','IMAGE_CLASSES','LIKES_WEIGHT','COMMENT_WEIGHT','MIN_IMAGE_WIDTH',\
+    'HASHTAG_QC','PHASH_MAX_DISTANCE','CLASSIFIER_DECODE','MAX_QUEUED_PER_PARK','TAG_LINE_1','TAG_LINE_2','TAG_LINE_3']
+
+
+def seed_cycle(process_pipe) -> dict:
+
+    """Fix the random seed and reference time of process_pipe for a cycle that is to be recorded"""
+
+    settings = {'seed':int.from_bytes(os.urandom(4),'little') & 0x7fffffff,'reference_time':datetime.now()}
+    process_pipe.set_params(image_choice__random_state=settings['seed'],\
+        feature_generation__reference_time=settings['reference_time'])
+
+    return settings
+
+def unseed_cycle(process_pipe) -> None:
+
+    process_pipe.set_params(image_choice__random_state=None,feature_generation__reference_time=None)
+
+def model_identities(process_pipe) -> dict:
+
+    """Checksums of the models used by process_pipe"""
+
+    identities = {}
+    steps = process_pipe.named_steps
+
+    if 'content_classification' in steps:
+        identities['caption_models'] = steps['content_classification'].model_identity
+    if 'image_classification' in steps:
+        identities['image_classifier'] = getattr(steps['image_classification'],'model_checksum',None) or \
+            file_checksum(steps['image_classification'].classifier)
+
+    return identities
+
+def _posts(result) -> list:
+
+    """Posts in a form that can be stored and compared: image file names rather than paths"""
+
+    posts = result if isinstance(result,list) else [result]
+
+    return [{'Image':os.path.basename(post['Image']) if isinstance(post['Image'],str) else None,\
+        'Caption':post['Caption'] if isinstance(post['Caption'],str) else None} for post in posts]
+
+
+def record(X,process_pipe,settings,result,mode='choose',queue_size=None,ledger=config.POST_LEDGER,\
+    record_dir=config.RECORD_DIR) -> str:
+
+    """Save a snapshot of a cycle. X is the metadata passed to process_pipe, settings is from
+    seed_cycle and result is what the cycle produced. mode is 'choose' (a single post, from
+    run_posting.choose_post) or 'schedule' (a queue of queue_size posts). Returns the snapshot directory"""
+
+    #to the microsecond, so that two cycles recorded within a second do not collide
+    snapshot = os.path.join(record_dir,f'{settings["reference_time"]:%Y-%m-%d_%H-%M-%S-%f}_{mode}')
+    os.makedirs(os.path.join(snapshot,'images'))
+
+    #link the images into the snapshot, so they survive being posted or cleaned up
+    X = X.copy()
+    for image_file in X['Flocation']:
+        if os.path.isfile(image_file):
+            iu.link_or_copy(image_file,os.path.join(snapshot,'images',os.path.basename(image_file)))
+    X['Flocation'] = [os.path.join('images',os.path.basename(image_file)) for image_file in X['Flocation']]
+    X.to_pickle(os.path.join(snapshot,'metadata.pkl'))
+
+    if os.path.isfile(ledger):
+        shutil.copyfile(ledger,os.path.join(snapshot,'post_ledger.db'))
+
+    info = {
+        'mode':mode,
+        'queue_size':queue_size,
+        'seed':settings['seed'],
+        'reference_time':str(settings['reference_time']),
+        'models':model_identities(process_pipe),
+        'settings':{name:getattr(config,name) for name in RECORDED_SETTINGS},
+        'posts':_posts(result)
+    }
+
+    with open(os.path.join(snapshot,'snapshot.json'),'w') as outfile:
+        json.dump(info,outfile,indent=2)
+
+    print(f'Recorded cycle in {snapshot}')
+
+    return snapshot
+
+
+def replay(snapshot,process_pipe=None) -> bool:
+
+    """Re-run a recorded cycle and check that it produces the same post(s). Caches start empty and
+    the ledger is a copy, so nothing outside the snapshot is changed. Returns True if it matches"""
+
+    import pipeline
+
+    with open(os.path.join(snapshot,'snapshot.json')) as infile:
+        info = json.load(infile)
+
+    X = pd.read_pickle(os.path.join(snapshot,'metadata.pkl'))
+    X['Flocation'] = [os.path.join(os.path.abspath(snapshot),image_file) for image_file in X['Flocation']]
+
+    if process_pipe is None:
+        process_pipe = pipeline.build_process_pipe()
+
+    for name, value in info['settings'].items():
+        current = getattr(config,name)
+        if json.loads(json.dumps(current)) != value:
+            print(f'Warning: {name} was {value} when recorded and is now {current}')
+
+    for name, identity in model_identities(process_pipe).items():
+        if info['models'].get(name) != identity:
+            print(f'Warning: the {name} are not the ones used when this was recorded')
+
+    with tempfile.TemporaryDirectory() as workdir:
+
+        ledger = os.path.join(workdir,'post_ledger.db')
+        if os.path.isfile(os.path.join(snapshot,'post_ledger.db')):
+            shutil.copyfile(os.path.join(snapshot,'post_ledger.db'),ledger)
+
+        params = {
+            'near_duplicate_filter__cache':os.path.join(workdir,'phash_cache.db'),
+            'near_duplicate_filter__ledger':ledger,
+            'near_duplicate_filter__hash_cache':os.path.join(workdir,'content_hash_cache.db'),
+            'feature_generation__size_cache':os.path.join(workdir,'image_size_cache.db'),
+            'feature_generation__reference_time':pd.Timestamp(info['reference_time']).to_pydatetime(),
+            'content_classification__cache':os.path.join(workdir,'classification_cache.db'),
+            'image_choice__random_state':info['seed']
+        }
+        if 'image_classification' in process_pipe.named_steps:
+            params['image_classification__cache'] = os.path.join(workdir,'classification_cache.db')
+        process_pipe.set_params(**params)
+
+        with instrumentation.cycle('replay',jsonl=None,prometheus=None) as metrics:
+
+            if info['mode'] == 'choose':
+                result = instrumentation.run_steps(process_pipe.steps,X)
+            else:
+                X = instrumentation.run_steps(process_pipe.steps[:-1],X)
+                result = process_pipe.steps[-1][1].fit(X).schedule(X,info['queue_size'])
+
+    for record in metrics.records:
+        print(f"    {record['stage']:40s} {record['wall_seconds']:8.3f} s wall {record['cpu_seconds']:8.3f} s cpu "
+            f"{record['rows_in']} -> {record['rows_out']}")
+
+    posts = _posts(result)
+    matches = posts == info['posts']
+
+    if matches:
+        print(f'{snapshot}: replay matches the recorded cycle')
+    else:
+        print(f'{snapshot}: replay differs from the recorded cycle')
+        for recorded, replayed in zip(info['posts'],posts):
+            if recorded != replayed:
+                print(f"    recorded {recorded['Image']}:\n{recorded['Caption']}\n    replayed {replayed['Image']}:\n{replayed['Caption']}")
+        if len(posts) != len(info['posts']):
+            print(f"    recorded {len(info['posts'])} posts, replayed {len(posts)}")
+
+    return matches
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('snapshots',nargs='+',help='snapshot directories written by record')
+    args = parser.parse_args()
+
+    results = [replay(snapshot) for snapshot in args.snapshots]
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+
+    main()
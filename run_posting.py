@@ -3,12 +3,14 @@
 
 import pipeline 
 import pandas as pd
-from instapy_cli import client
-from datetime import datetime
 import os
 import time
 from config import config
 import numpy as np
+from ledger import PostLedger, PostQueue
+import instrumentation
+import replay
+from datadownloaders import repo_version
 
 
 def run_extract_stats() -> None:
@@ -19,31 +21,114 @@ def run_extract_stats() -> None:
 
 	print("Done extract stats")
 
-def choose_post() -> dict:
+def choose_post(process_pipe=None) -> dict:
 
 	"""Returns a dictionary containing the path of the image
-	to be posted and the caption to accompany it"""
+	to be posted and the caption to accompany it. Uses pipeline.process_pipe
+	unless another pipeline is given"""
 
-	#X is a dataframe containing the metadata for each of the downloaded posts, ready for processing
-	X = pipeline.metadata_gen.process_posts()
+	if process_pipe is None:
+		process_pipe = pipeline.process_pipe
 
-	if X.shape[0] < 2:
+	with instrumentation.cycle('posting'):
 
-		return {'Image':'no_image','Caption':np.nan}
+		#X is a dataframe containing the metadata for each of the downloaded posts, ready for processing
+		X = pipeline.metadata_gen.process_posts()
 
-	else:
+		if X.shape[0] < 2:
+
+			return {'Image':'no_image','Caption':np.nan}
+
+		else:
+
+			#This processing pipeline will produce the file that we want to repost and its
+			#associated caption and credits. The stages are run (and measured) one at a time,
+			#which is what process_pipe.fit_transform(X) does
+
+			if config.RECORD_DIR:
+				settings = replay.seed_cycle(process_pipe)
+
+			#the pipe is long lived, so it must not be left with a fixed seed if anything fails
+			try:
+				result = instrumentation.run_steps(process_pipe.steps,X)
+				#result = pipeline.process_pipe.transform(X)
+
+				if config.RECORD_DIR:
+					replay.record(X,process_pipe,settings,result,mode='choose')
+			finally:
+				if config.RECORD_DIR:
+					replay.unseed_cycle(process_pipe)
+			
+			return result
 
-		#This processing pipeline will produce the file that we want to repost and its
-		#associated caption and credits
+def schedule_posts(process_pipe=None,queue_size=config.POST_QUEUE_SIZE) -> int:
+
+	"""Run the processing pipeline once and queue up the next queue_size posts, replacing
+	any left in the queue. Returns the number of posts queued"""
+
+	if process_pipe is None:
+		process_pipe = pipeline.process_pipe
+
+	#taken first, so that posts downloaded while scheduling make the queue out of date
+	version = repo_version(config.POSTS)
+
+	with instrumentation.cycle('scheduling'):
+
+		X = pipeline.metadata_gen.process_posts()
+		posts = []
+
+		if X.shape[0] >= 2:
+
+			if config.RECORD_DIR:
+				settings = replay.seed_cycle(process_pipe)
+				recorded_X = X
+
+			try:
+				#every stage but the last, then choose several posts rather than one
+				X = instrumentation.run_steps(process_pipe.steps[:-1],X)
 
-		result = pipeline.process_pipe.fit_transform(X)
-		#result = pipeline.process_pipe.transform(X)
-		
-		return result
+				with instrumentation.stage('process_pipe.schedule',len(X)) as record:
+					posts = process_pipe.steps[-1][1].fit(X).schedule(X,queue_size)
+					record['rows_out'] = len(posts)
 
-def generate_post(post_meta,post_online=False) -> None:
+				if config.RECORD_DIR:
+					replay.record(recorded_X,process_pipe,settings,posts,mode='schedule',queue_size=queue_size)
+			finally:
+				if config.RECORD_DIR:
+					replay.unseed_cycle(process_pipe)
 
-	'''This uploads a selected image and caption to instagram'''
+	queue = PostQueue()
+	queue.replace(posts,repo_version=version)
+	queue.close()
+
+	print(f'Scheduled {len(posts)} posts')
+
+	return len(posts)
+
+def next_post(process_pipe=None) -> dict:
+
+	"""Take the next post from the queue. The queue is refilled first if it is empty or
+	posts have been downloaded since it was filled"""
+
+	queue = PostQueue()
+
+	#DownloadNewPosts swaps in a new version of the post database when it adds posts. Removing posts
+	#from it does not change the version, and pop skips any that have gone
+	if queue.scheduled() is None or queue.repo_version() != repo_version(config.POSTS):
+		schedule_posts(process_pipe)
+
+	post = queue.pop()
+	queue.close()
+
+	if post is None:
+		return {'Image':'no_image','Caption':np.nan}
+
+	return post
+
+def generate_post(post_meta,post_online=False,cli=None) -> None:
+
+	'''This uploads a selected image and caption to instagram. A new upload session
+	is opened unless one is given as cli'''
 
 	username = config.INSTA_UNAME
 	password = config.INSTA_PASS
@@ -63,21 +148,30 @@ def generate_post(post_meta,post_online=False) -> None:
 
 	if post_online == True:
 
-		with client(username, password, write_cookie_file=False) as cli:
-			try:
-				cli.upload(image_file, image_caption)
-			except:
-				print('Issue: unable to upload at this time!')
+		if cli is None:
+			from instapy_cli import client
+			with client(username, password, write_cookie_file=False) as cli:
+				_upload(cli,image_file,image_caption)
+		else:
+			_upload(cli,image_file,image_caption)
 
-	#append to previous posts 
-	used_image_file = open(config.PREV_POSTS,'a')
-	used_image_file.write(f"{image_file},{datetime.now()}\n")
-	used_image_file.close()
+	#record the post in the ledger
+	ledger = PostLedger()
+	ledger.add(image_file)
+	ledger.close()
 
 	#remove the image file so that it can't be included in the next round of image collection
 	os.remove(image_file)
 
 
+def _upload(cli,image_file,image_caption) -> None:
+
+	try:
+		cli.upload(image_file, image_caption)
+	except:
+		print('Issue: unable to upload at this time!')
+
+
 def posting_wrapper(error_check=False) -> None:
 
 	'''For automated downloads'''
@@ -103,7 +197,7 @@ def posting_wrapper(error_check=False) -> None:
 def _postloop() -> None:
     
         #run_extract_stats()
-	post = choose_post()
+	post = next_post()
 
 	print(post)
 